@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""Micro-benchmarks for the generator, board and view serialization hot paths.
+
+Run from the repository root (generators are loaded from ./generators):
+
+    python benchmark.py -o bench.json
+    python benchmark.py -o new.json --baseline bench.json --threshold 0.25
+
+Exits with status 1 if any benchmark is slower than its baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable
+
+import generators
+from boards import ALIASES, Board, Exploration13, Invasion, Invasion13, Lockout, create_board
+from rooms import Room
+
+SEED = "benchmark"
+BOARD_GAME = "Hollow Knight"
+BOARD_GENERATOR = "Item Randomizer"  # Largest catalog, supports every board size
+TEAMS = ("team-a", "team-b")
+
+def measure(fn: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """Times `fn`, scaling the loop count so that each repeat takes at least `min_time` seconds."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops): fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20: break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops): fn()
+        timings.append((time.perf_counter() - start) / loops)
+    return {"min": min(timings), "median": statistics.median(timings), "loops": loops, "repeat": repeat}
+
+def fill_invasion(board: Invasion, leave: int) -> None:
+    """Alternately marks the first valid move for two teams until `leave` cells remain unmarked."""
+    cells = board.width * board.height
+    marked = 0
+    stuck = 0
+    while marked < cells - leave and stuck < len(TEAMS):
+        team = TEAMS[marked % len(TEAMS)]
+        moves = board.valid_moves(team)
+        if not moves:
+            stuck += 1
+            marked += 1  # Let the other team continue
+            continue
+        stuck = 0
+        board.mark(min(moves), team)
+        marked = sum(len(m) for m in board.marks.values())
+
+def fill_board(board: Board, fraction: float) -> None:
+    """Marks roughly `fraction` of the board, alternating teams and respecting the board's own rules."""
+    cells = board.width * board.height
+    if isinstance(board, Invasion):
+        fill_invasion(board, cells - int(cells * fraction))
+        return
+    target = int(cells * fraction)
+    marked = set()
+    while len(marked) < target:
+        progress = False
+        for team in TEAMS:
+            for i in range(cells):
+                if i not in marked and board.mark(i, team):
+                    marked.add(i)
+                    progress = True
+                    break
+        if not progress: return
+
+def generator_cases() -> dict[str, Callable]:
+    board_gen = generators.get_generator(BOARD_GAME, BOARD_GENERATOR)
+    sizes = sorted({b.width * b.height for b in (create_board(alias, board_gen, SEED) for alias in ALIASES)})
+    cases = {}
+    for game, gens in generators.ALL.items():
+        for gen_name, gen in gens.items():
+            for n in sizes:
+                try: gen.get(SEED, n)
+                except (ValueError, IndexError): continue  # Catalog too small for this board size
+                cases[f"generate/{game}/{gen_name}/{n}"] = lambda gen=gen, n=n: gen.get(SEED, n)
+    return cases
+
+def board_cases() -> dict[str, Callable]:
+    gen = generators.get_generator(BOARD_GAME, BOARD_GENERATOR)
+    cases = {}
+    for alias in ALIASES:
+        cases[f"create_board/{alias}"] = lambda alias=alias: create_board(alias, gen, SEED)
+
+    lockout = Lockout(13, 13, gen, SEED)
+    for i in range(13 * 13 - 4): lockout.mark(i, TEAMS[i % 2])
+    cases["lockout13/can_mark"] = lambda: lockout.can_mark(13 * 13 - 1, TEAMS[0])
+
+    invasion = Invasion13(gen, SEED)
+    fill_invasion(invasion, 6)
+    team = TEAMS[0]
+    move = min(invasion.valid_moves(team))
+    def mark_unmark():
+        invasion.mark(move, team)
+        invasion.unmark(move, team)
+    cases["invasion13/valid_moves"] = lambda: invasion.valid_moves(team)
+    cases["invasion13/mark_unmark"] = mark_unmark
+
+    exploration = Exploration13(gen, SEED)
+    fill_board(exploration, 0.5)
+    cases["exploration13/_get_seen"] = lambda: exploration._get_seen(TEAMS[0])
+    return cases
+
+def view_cases() -> dict[str, Callable]:
+    gen = generators.get_generator(BOARD_GAME, BOARD_GENERATOR)
+    cases = {}
+    for alias in ALIASES:
+        board = create_board(alias, gen, SEED)
+        fill_board(board, 0.5)
+        cases[f"view/{alias}/team"] = lambda board=board: json.dumps(board.get_team_view(TEAMS[0]))
+        cases[f"view/{alias}/full"] = lambda board=board: json.dumps(board.get_full_view())
+    return cases
+
+SUITES = {"generators": generator_cases, "boards": board_cases, "views": view_cases}
+
+def allocated(fn: Callable[[], object]) -> tuple[int, object]:
+    """Bytes still allocated by `fn` once it returns, and its result (kept alive while measuring)."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+def make_rooms(count: int) -> list[Room]:
+    """Rooms on 13x13 boards, each with two teams of two users and half the board marked."""
+    out = []
+    for i in range(count):
+        room = Room(f"room {i}", BOARD_GAME, BOARD_GENERATOR, "Invasion (Large)", f"{SEED}-{i}")
+        for t, team_name in enumerate(TEAMS):
+            team = room.create_team(team_name, "#FFFFFF")
+            for u in range(2):
+                user = room.users[room.add_user(f"user {t}-{u}")]
+                team.add_user(user)
+                user.teamId = team.id
+        fill_board(room.board, 0.5)
+        out.append(room)
+    return out
+
+def memory_results(rooms: int) -> dict[str, dict]:
+    catalog_bytes, _ = allocated(generators.load_catalogs)
+    room_bytes, _ = allocated(lambda: make_rooms(rooms))
+    return {"memory/catalogs": {"bytes": catalog_bytes},
+            f"memory/rooms/{rooms}": {"bytes": room_bytes, "per_room": room_bytes // max(rooms, 1)}}
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Returns a description of every benchmark slower than `baseline` by more than `threshold`."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None: continue
+        key, unit, scale = ("min", "us", 1e6) if "min" in result else ("bytes", "B", 1)
+        ratio = result[key] / base[key] if base[key] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append(f"{name}: {base[key] * scale:.2f}{unit} -> {result[key] * scale:.2f}{unit} ({ratio:.2f}x)")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("-b", "--baseline", help="JSON results to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=0.25,
+                        help="allowed slowdown relative to the baseline (default: %(default)s)")
+    parser.add_argument("-s", "--suite", action="append", choices=SUITES, help="only run these suites")
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per repeat")
+    parser.add_argument("--memory", type=int, metavar="ROOMS", default=0,
+                        help="also measure catalog memory and the footprint of this many 13x13 rooms")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for suite in args.suite or SUITES:
+        for name, fn in SUITES[suite]().items():
+            if args.filter not in name: continue
+            results[name] = measure(fn, args.repeat, args.min_time)
+            print(f"{name:<70} {results[name]['min'] * 1e6:12.2f}us")
+    if args.memory:
+        for name, result in memory_results(args.memory).items():
+            results[name] = result
+            print(f"{name:<70} {result['bytes']:12d}B")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                       "python": platform.python_version(),
+                       "results": results}, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        for r in regressions: print(f"REGRESSION | {r}")
+        if regressions: return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
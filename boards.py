@@ -1,4 +1,5 @@
 import logging
+from functools import cache
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -8,9 +9,28 @@ if TYPE_CHECKING:
 _log = logging.getLogger("byngosink")
 _log.propagate = False
 
+@cache
+def board_lines(width: int, height: int) -> tuple[tuple[int, ...], tuple[tuple[str, int], ...]]:
+    """For each index, the lines through it; and each line's (kind, number).
+    
+    Lines are numbered rows first, then columns, then the diagonals of square boards."""
+    lines = [("row", y) for y in range(height)] + [("col", x) for x in range(width)]
+    if width == height: lines += [("diagonal", 0), ("diagonal", 1)]
+    through = []
+    for i in range(width * height):
+        x, y = i % width, i // width
+        ids = [y, height + x]
+        if width == height:
+            if x == y: ids.append(height + width)
+            if x + y == width - 1: ids.append(height + width + 1)
+        through.append(tuple(ids))
+    return tuple(through), tuple(lines)
+
 class Board():
     """Basic unbiased board"""
     name = "Board"
+    resumable = True  # Whether clients can catch up by replaying mark events instead of taking a new view
+    detects_lines = True  # Whether completed rows, columns and diagonals are announced
     def __init__(self, w, h, generator: "T_GENERATOR", seed: str) -> None:
         self.width = w
         self.height = h
@@ -21,10 +41,15 @@ class Board():
         self.seed = seed
         self.goals: list[T_GOAL] = generator.get(seed, w*h)
         self.marks: dict[str, set] = {} # {Teamid : {goals}}
+        self.line_counts: dict[str, list[int]] = {}  # {Teamid : marks in each line (see `board_lines`)}
+        self.lines_announced: dict[str, set[int]] = {}  # {Teamid : lines already announced}, so re-marks stay quiet
+        self.result: dict | None = None  # Set by the first team to finish; never revoked
+        self.events: list[dict] = []  # LINE/FINISHED messages waiting to be announced
     
     def __min_view(self):
         return {"type": self.name, "width": self.width, "height": self.height,
-                "maxMarksPerSquare": self.max_marks_per_square(), "game": self.game, "generatorName": self.generatorName}
+                "maxMarksPerSquare": self.max_marks_per_square(), "game": self.game, "generatorName": self.generatorName,
+                "result": self.result}
     
     def max_marks_per_square(self) -> int:
         return 0  # Infinity
@@ -36,6 +61,10 @@ class Board():
     def get_team_view(self, teamId) -> dict:
         """Provides a view on the board for a given team."""
         return self.get_full_view()
+
+    def get_extras(self, teamId) -> dict | None:
+        """Team-specific details sent alongside the team view, if the format has any."""
+        return None
     
     def get_spectator_view(self) -> dict:
         """Provides the base spectator view (this may not include all goals for some formats)"""
@@ -57,8 +86,39 @@ class Board():
             self.marks[teamid] = {index}
         else: 
             self.marks[teamid].add(index)
+        self._count_lines(index, teamid, 1)
+        if self.result is None:
+            reason = self.finish_reason(index, teamid)
+            if reason is not None:
+                self.result = {"teamId": teamid, "reason": reason}
+                self.events.append({"verb": "FINISHED"} | self.result)
         return True
 
+    def _count_lines(self, index, teamid, delta):
+        through, lines = board_lines(self.width, self.height)
+        counts = self.line_counts.get(teamid, None)
+        if counts is None: counts = self.line_counts[teamid] = [0] * len(lines)
+        for line in through[index]:
+            counts[line] += delta
+            if delta > 0 and self.detects_lines and counts[line] == self._line_length(lines[line][0]):
+                announced = self.lines_announced.setdefault(teamid, set())
+                if line in announced: continue
+                announced.add(line)
+                kind, number = lines[line]
+                self.events.append({"verb": "LINE", "teamId": teamid, "kind": kind, "index": number})
+
+    def _line_length(self, kind) -> int:
+        return self.height if kind == "col" else self.width
+
+    def finish_reason(self, index, teamid) -> str | None:
+        """Checked after each mark: why `teamid` has now won the board, if it has."""
+        if len(self.marks[teamid]) == self.width * self.height: return "blackout"
+        return None
+
+    def pop_events(self) -> list[dict]:
+        events, self.events = self.events, []
+        return events
+
     def can_unmark(self, index, teamid) -> bool:
         """Checked on unmark to maintain board invariants."""
         return teamid in self.marks and index in self.marks[teamid]
@@ -70,8 +130,21 @@ class Board():
         marks.remove(index)
         if not marks:
             self.marks.pop(teamid)
+        self._count_lines(index, teamid, -1)
         return True
 
+    def get_state(self) -> dict:
+        """What a board regenerated from the same generator and seed needs to continue play (see `set_state`)."""
+        return {"marks": {t: sorted(m) for t, m in self.marks.items()}, "result": self.result}
+
+    def set_state(self, state: dict):
+        self.marks, self.line_counts, self.lines_announced = {}, {}, {}
+        for teamid, marks in state["marks"].items():
+            self.marks[teamid] = set(marks)
+            for index in marks: self._count_lines(index, teamid, 1)
+        self.result = state["result"]
+        self.events = []  # Already announced by the board this state came from
+
     def get_dict(self) -> dict:
         return {"type": str(type(self)),
                 "width": self.width,
@@ -109,6 +182,10 @@ class Lockout(Bingo):
         marked = set([v for marks in self.marks.values() for v in marks])
         return index not in marked
 
+    def finish_reason(self, index, teamid):
+        if len(self.marks[teamid]) > self.width * self.height // 2: return "majority"
+        return super().finish_reason(index, teamid)
+
 class Lockout5(Lockout):
     name = "Lockout"
     
@@ -122,6 +199,16 @@ INVASION_RIGHT = 3
 INVASION_BOTTOM = 4
 INVASION_ALL = frozenset([1, 2, 3, 4])
 
+@cache
+def invasion_ranks(width: int, height: int) -> dict[int, tuple[frozenset[int], ...]]:
+    """Board indexes in each rank, ordered away from each starting side. Shared by every board of this size."""
+    ranks = dict()
+    ranks[INVASION_TOP] = tuple(frozenset([x + y * width for x in range(width)]) for y in range(height))
+    ranks[INVASION_LEFT] = tuple(frozenset([x + y * width for y in range(height)]) for x in range(width))
+    ranks[INVASION_RIGHT] = tuple(reversed(ranks[INVASION_LEFT]))
+    ranks[INVASION_BOTTOM] = tuple(reversed(ranks[INVASION_TOP]))
+    return ranks
+
 class Invasion(Lockout):
     """Basic invasion bingo board"""
     def __init__(self, width: int, height: int, generator: "T_GENERATOR", seed) -> None:
@@ -129,12 +216,7 @@ class Invasion(Lockout):
         self.width = width
         self.height = height
         self.start_constraints = dict()  # teamId -> invasionStart
-
-        self.ranks = dict()  # constraint -> list[set(index)]
-        self.ranks[INVASION_TOP] = [frozenset([self.index(x, y) for x in range(self.width)]) for y in range(self.height)]
-        self.ranks[INVASION_LEFT] = [frozenset([self.index(x, y) for y in range(self.height)]) for x in range(self.width)]
-        self.ranks[INVASION_RIGHT] = list(reversed(self.ranks[INVASION_LEFT]))
-        self.ranks[INVASION_BOTTOM] = list(reversed(self.ranks[INVASION_TOP]))
+        self.ranks = invasion_ranks(width, height)  # constraint -> tuple[frozenset(index)]
 
     def other_team(self, teamid):
         for t in self.start_constraints:
@@ -204,13 +286,21 @@ class Invasion(Lockout):
         moves = self.valid_moves(teamid)
         c = moves.get(index, None)
         if c is not None:
-            super().mark(index, teamid)
-
-            # Update constraints
+            # Update constraints first, so finish_reason sees the team's direction
             self.update_constraints(teamid, c)
+            super().mark(index, teamid)
             return True
         else:
             return False
+
+    def finish_reason(self, index, teamid):
+        """Reaching the far side from the team's starting side, or a majority.
+        
+        Until the starting side is settled, only a mark on the far side from every side still possible counts,
+        so marking along the team's own edge isn't an arrival."""
+        constraints = self.start_constraints.get(teamid, ())
+        if constraints and all(index in self.ranks[c][-1] for c in constraints): return "arrival"
+        return super().finish_reason(index, teamid)
     
     def replay(self, teamid, indexes, constraints) -> bool:
         tomove = set(indexes)
@@ -247,12 +337,23 @@ class Invasion(Lockout):
                 return False
 
         self.marks = b.marks
+        self.line_counts = b.line_counts
         self.start_constraints = b.start_constraints
         return True
 
+    def get_state(self) -> dict:
+        return super().get_state() | {"startConstraints": {t: sorted(c) for t, c in self.start_constraints.items()}}
+
+    def set_state(self, state: dict):
+        super().set_state(state)
+        self.start_constraints = {t: frozenset(c) for t, c in state["startConstraints"].items()}
+
+    def get_extras(self, teamId) -> dict:
+        return {"invasionMoves": list(self.valid_moves(teamId).keys())}
+
     def get_team_view(self, teamId) -> dict: 
         """`extras`: valid next moves"""
-        return super().get_team_view(teamId) | {"extras": {"invasionMoves": list(self.valid_moves(teamId).keys())}}
+        return super().get_team_view(teamId) | {"extras": self.get_extras(teamId)}
 
 class Invasion5(Invasion):
     """Standard 5x5 Invasion board."""
@@ -273,12 +374,14 @@ class Exploration(Board):
     
     Center->Corner"""
     name = "Exploration"
+    resumable = False  # Marks reveal goals, so replaying them would need the hidden goals too
+    detects_lines = False
     base: set[int] = set()
     finals: set[int] = set()
     
     def get_minimum_view(self) -> dict:
         return {"type": self.name, "width": self.width, "height": self.height,
-                "game": self.game, "generatorName": self.generatorName,
+                "game": self.game, "generatorName": self.generatorName, "result": self.result,
                 "goals": {i:self.goals[i].get_repr() for i in self.base},
                 "base": list(self.base), "finals": list(self.finals)}
     
@@ -306,6 +409,10 @@ class Exploration(Board):
         if index not in seen: return False
         else: return True
 
+    def finish_reason(self, index, teamid):
+        if index in self.finals: return "arrival"
+        return super().finish_reason(index, teamid)
+
     def _get_surrounding(self, index):
         x = index % self.width
         y = index // self.height
@@ -387,4 +494,8 @@ ALIASES = {
 }
 
 def create_board(boardstr, generator: "T_GENERATOR", seed) -> Board:
-    return ALIASES[boardstr](generator, seed)
\ No newline at end of file
+    return ALIASES[boardstr](generator, seed)
+
+def board_alias(board: Board) -> str:
+    """The `create_board` name of `board`'s type (display names aren't unique)."""
+    return next(alias for alias, cls in ALIASES.items() if type(board) is cls)
\ No newline at end of file
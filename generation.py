@@ -0,0 +1,55 @@
+"""Board generation off the event loop.
+
+Rooms are generated on a thread pool, so the board keeps sharing goal definitions with the loaded catalogs.
+GENERATE previews, which only need a view, are spread across worker processes."""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import boards
+import generators
+
+THREAD_WORKERS = 4
+PROCESS_WORKERS = os.cpu_count() or 1
+MAX_PREVIEWS = 64  # Seeds per GENERATE request
+
+_threads: ThreadPoolExecutor | None = None
+_processes: ProcessPoolExecutor | None = None
+
+def _thread_pool() -> ThreadPoolExecutor:
+    global _threads
+    if _threads is None: _threads = ThreadPoolExecutor(THREAD_WORKERS, thread_name_prefix="generate")
+    return _threads
+
+def _process_pool() -> ProcessPoolExecutor:
+    global _processes
+    if _processes is None:
+        # Forked workers inherit the loaded catalogs; spawned ones would re-import the server's main module
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        _processes = ProcessPoolExecutor(PROCESS_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _processes
+
+def start():
+    """Starts the worker processes now, before the server has other threads that forking could copy mid-operation."""
+    _process_pool().submit(int).result()
+
+async def create_board(board_str, generator: "generators.T_GENERATOR", seed) -> boards.Board:
+    return await asyncio.get_running_loop().run_in_executor(_thread_pool(), boards.create_board, board_str, generator, seed)
+
+def preview(game, generator_str, board_str, seeds: list) -> list[dict]:
+    """Full views of the boards `seeds` produce."""
+    generator = generators.get_generator(game, generator_str)
+    return [boards.create_board(board_str, generator, seed).get_full_view() | {"seed": seed} for seed in seeds]
+
+async def previews(game, generator_str, board_str, seeds: list) -> list[dict]:
+    """`preview` with the seeds split evenly across worker processes, in order."""
+    if len(seeds) <= 1:
+        return await asyncio.get_running_loop().run_in_executor(_thread_pool(), preview, game, generator_str, board_str, seeds)
+
+    pool = _process_pool()
+    chunk = -(-len(seeds) // PROCESS_WORKERS)
+    loop = asyncio.get_running_loop()
+    parts = await asyncio.gather(*[loop.run_in_executor(pool, preview, game, generator_str, board_str, seeds[i:i + chunk])
+                                   for i in range(0, len(seeds), chunk)])
+    return [view for part in parts for view in part]
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Seed distribution analysis for generator catalogs.
+
+Samples many seeds through the real generators and reports, per generator and board size:
+goal frequencies, the most common goal pairs, exclusion pairs that appeared together and
+how many tiebreaker goals boards received. Run from the repository root:
+
+    python generatorAnalysis.py "Hollow Knight" -g "Item Randomizer" -n 1000000 -o report.json
+
+Requires numpy.
+"""
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import generators
+from boards import ALIASES, create_board
+from goals import ExclusionGoal, TiebreakerGoal
+
+CHUNK = 5000  # Seeds per worker task; bounds the one-hot matrix each worker builds
+
+def board_sizes() -> dict[int, list[str]]:
+    """Board aliases grouped by cell count (generators only see the count)."""
+    sample = next(gen for gens in generators.ALL.values() for gen in gens.values() if gen.count >= 169)
+    sizes: dict[int, list[str]] = {}
+    for alias in ALIASES:
+        board = create_board(alias, sample, "0")
+        sizes.setdefault(board.width * board.height, []).append(alias)
+    return dict(sorted(sizes.items()))
+
+def sample_chunk(args) -> tuple[np.ndarray, np.ndarray, int]:
+    """Goal co-occurrence counts, tiebreakers-per-board histogram and failed seed count for seeds [start, start + count)."""
+    game, gen_name, n, start, count = args
+    gen = generators.ALL[game][gen_name]
+    index = {gid: i for i, gid in enumerate(gen.goals)}
+    tiebreakers = np.array([isinstance(g, TiebreakerGoal) for g in gen.goals.values()], dtype=np.float32)
+
+    picks = np.empty((count, n), dtype=np.int32)
+    row = 0
+    for seed in range(start, start + count):
+        try: picks[row] = [index[g.id] for g in gen.get(seed, n)]
+        except (ValueError, IndexError): continue  # Generator ran out of compatible goals
+        row += 1
+    picks = picks[:row]
+
+    onehot = np.zeros((row, len(index)), dtype=np.float32)  # float32 counts are exact below 2**24
+    np.put_along_axis(onehot, picks, 1, axis=1)
+    cooccurrence = (onehot.T @ onehot).astype(np.int64)
+    per_board = (onehot @ tiebreakers).astype(np.int64)
+    return cooccurrence, np.bincount(per_board, minlength=n + 1), count - row
+
+def analyse(pool: Pool, game: str, gen_name: str, n: int, seeds: int, top: int) -> dict:
+    gen = generators.ALL[game][gen_name]
+    ids = list(gen.goals)
+    tasks = [(game, gen_name, n, start, min(CHUNK, seeds - start)) for start in range(0, seeds, CHUNK)]
+
+    cooccurrence = np.zeros((len(ids), len(ids)), dtype=np.int64)
+    tiebreakers = np.zeros(n + 1, dtype=np.int64)
+    failed = 0
+    for co, tb, f in pool.imap_unordered(sample_chunk, tasks):
+        cooccurrence += co
+        tiebreakers += tb
+        failed += f
+    boards = max(seeds - failed, 1)
+
+    frequency = np.diag(cooccurrence) / boards
+    pairs = np.triu(cooccurrence, k=1)
+    order = np.argsort(pairs, axis=None)[::-1][:top]
+
+    violations = []
+    for gid, goal in gen.goals.items():
+        if not isinstance(goal, ExclusionGoal): continue
+        for excluded in goal.exclusions:
+            if excluded not in gen.goals: continue
+            together = int(cooccurrence[ids.index(gid), ids.index(excluded)])
+            if together: violations.append({"goal": gid, "excludes": excluded, "boards": together})
+
+    return {"seeds": seeds,
+            "failedSeeds": failed,
+            "expectedFrequency": n / len(ids),
+            "frequency": {gid: round(float(f), 6) for gid, f in sorted(zip(ids, frequency), key=lambda p: -p[1])},
+            "topPairs": [{"goals": [ids[i], ids[j]], "frequency": round(float(pairs[i, j]) / boards, 6)}
+                         for i, j in zip(*np.unravel_index(order, pairs.shape))],
+            "exclusionViolations": violations,
+            "tiebreakersPerBoard": {k: int(v) for k, v in enumerate(tiebreakers) if v}}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("game", choices=generators.ALL)
+    parser.add_argument("-g", "--generator", action="append", help="only analyse these generators")
+    parser.add_argument("-b", "--board", action="append", choices=ALIASES, help="only analyse these board types")
+    parser.add_argument("-n", "--seeds", type=int, default=100_000)
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--top", type=int, default=20, help="most common goal pairs to report")
+    parser.add_argument("-o", "--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    report = {}
+    with Pool(args.workers) as pool:
+        for gen_name in args.generator or generators.ALL[args.game]:
+            gen = generators.ALL[args.game][gen_name]
+            for n, aliases in board_sizes().items():
+                if args.board and not set(aliases) & set(args.board): continue
+                if gen.count < n: continue
+
+                started = time.perf_counter()
+                result = analyse(pool, args.game, gen_name, n, args.seeds, args.top)
+                result["boards"] = aliases
+                report.setdefault(gen_name, {})[n] = result
+                print(f"{gen_name} | {n} goals ({', '.join(aliases)}) | {args.seeds} seeds in {time.perf_counter() - started:.1f}s"
+                      f" | {result['failedSeeds']} failed | {len(result['exclusionViolations'])} exclusion violations")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({args.game: report}, f, indent=4, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
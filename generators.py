@@ -1,6 +1,9 @@
 import pyjson5 as jsonc
+import hashlib
+import json
 import os
 import random
+from collections import OrderedDict
 
 from typing import Union, TYPE_CHECKING
 
@@ -12,17 +15,33 @@ if TYPE_CHECKING:
 
 from goals import parse_goal, ExclusionGoal, TiebreakerGoal
 
+FIXED_POOL_SIZE = 256  # Distinct custom goal lists kept parsed for fixed rooms
+FIXED_GOAL_POOL_SIZE = 16384  # Distinct custom goals shared between those lists
+
+_fixed_pool: OrderedDict[str, "FixedGenerator"] = OrderedDict()  # Content hash -> generator, least recently used first
+_fixed_goals: OrderedDict[str, "T_GOAL"] = OrderedDict()
+
+def _fixed_goal(name: str) -> "T_GOAL":
+    """The shared definition of a custom goal, so overlapping lists don't each hold a copy."""
+    goal = _fixed_goals.get(name, None)
+    if goal is None:
+        goal = _fixed_goals[name] = parse_goal(name, {"name": name})
+        if len(_fixed_goals) > FIXED_GOAL_POOL_SIZE: _fixed_goals.popitem(last=False)
+    else: _fixed_goals.move_to_end(name)
+    return goal
+
 class FixedGenerator():
     def __init__(self, name, generator={}, **params) -> None:
         self.name = name
-        self.goals = generator["goals"]  # This is just a list of strings in this case (and this case only)
+        self.goals = tuple(generator["goals"])  # This is just a list of strings in this case (and this case only)
         self.count = len(self.goals)
         self.game = generator["game"]
         self.languages = {} # Custom goal lists don't support this I think - abyss
+        self._parsed = [_fixed_goal(g) for g in self.goals]
         self.__dict__.update(params)
     
     def get(self, seed, n) -> list["T_GOAL"]:
-        return [parse_goal(g, {"name":g}) for g in self.goals[:n]]
+        return self._parsed[:n]
 
 class BaseGenerator():
     def __init__(self, name, generator: dict = {}, **params) -> None:
@@ -34,16 +53,16 @@ class BaseGenerator():
         self.__dict__.update(params)
     
     def get(self, seed, n) -> list["T_GOAL"]:
-        random.seed(seed)
-        return random.sample(list(self.goals.values()), n)
+        rng = random.Random(seed)  # Per call, so generation is deterministic and thread safe
+        return rng.sample(list(self.goals.values()), n)
 
 class MutexGenerator(BaseGenerator):
     def get(self, seed, n) -> list["T_GOAL"]:
-        random.seed(seed)
+        rng = random.Random(seed)
         available = self.goals.copy()
         sample = []
         for i in range(n):
-            choice_key = random.choice(list(available.keys()))
+            choice_key = rng.choice(list(available.keys()))
             choice = available[choice_key]
             sample.append(choice)
             available.pop(choice_key)
@@ -58,7 +77,7 @@ class TiebreakerGenerator(BaseGenerator):
         super().__init__(name, generator)
     
     def get(self, seed, n) -> list["T_GOAL"]:
-        random.seed(seed)
+        rng = random.Random(seed)
         sample = []
         available = self.goals.copy()
         tiebreakers = self.tiebreakers
@@ -69,7 +88,7 @@ class TiebreakerGenerator(BaseGenerator):
                     goal = available[gid]
                     if isinstance(goal, TiebreakerGoal): available.pop(gid)
             
-            choice_key = random.choice(list(available.keys()))
+            choice_key = rng.choice(list(available.keys()))
             choice = available[choice_key]
             sample.append(choice)
             available.pop(choice_key)
@@ -79,7 +98,7 @@ class TiebreakerGenerator(BaseGenerator):
 
 class TiebreakerMutexGenerator(TiebreakerGenerator):
     def get(self, seed, n) -> list["T_GOAL"]:
-        random.seed(seed)
+        rng = random.Random(seed)
         sample = []
         available = self.goals.copy()
         tiebreakers = self.tiebreakers
@@ -90,7 +109,7 @@ class TiebreakerMutexGenerator(TiebreakerGenerator):
                     goal = available[gid]
                     if isinstance(goal, TiebreakerGoal): available.pop(gid)
             
-            choice_key = random.choice(list(available.keys()))
+            choice_key = rng.choice(list(available.keys()))
             choice = available[choice_key]
             sample.append(choice)
             available.pop(choice_key)
@@ -107,19 +126,32 @@ def _create_gen(name, gendict: dict) -> Union[BaseGenerator, FixedGenerator]:
     genType: type = globals()[typestr]
     return genType(name, gendict)
 
-def get_generator(game_name, gen_name, goals: list[str] | None = None):
-    if gen_name == "Fixed" and goals is not None:
-        return FixedGenerator(name="Fixed Board", generator={
+def fixed_generator(game_name, goals: list[str]) -> FixedGenerator:
+    """A generator for a custom goal list, shared by every fixed room with the same game and list."""
+    key = hashlib.sha256(json.dumps([game_name, goals]).encode()).hexdigest()
+    generator = _fixed_pool.get(key, None)
+    if generator is None:
+        generator = _fixed_pool[key] = FixedGenerator(name="Fixed Board", generator={
                 "goals": goals,
                 "game": game_name
             })
+        if len(_fixed_pool) > FIXED_POOL_SIZE: _fixed_pool.popitem(last=False)  # Rooms using it keep their reference
+    else: _fixed_pool.move_to_end(key)
+    return generator
+
+def get_generator(game_name, gen_name, goals: list[str] | None = None):
+    if gen_name == "Fixed" and goals is not None:
+        return fixed_generator(game_name, goals)
     else:
         return ALL[game_name][gen_name]
 
-ALL: dict[str, dict[str, "T_GENERATOR"]] = {}
+def load_catalogs(path="generators") -> dict[str, dict[str, "T_GENERATOR"]]:
+    catalogs = {}
+    for gamepath in os.listdir(path):
+        if not gamepath.endswith(".jsonc") or gamepath.startswith("_"): continue
+        with open(f"{path}/{gamepath}", encoding="utf-8") as f:
+            game_name = os.path.splitext(gamepath)[0]
+            catalogs[game_name] = {name: _create_gen(name, gendict | {"game": game_name}) for name, gendict in jsonc.load(f).items()}
+    return catalogs
 
-for gamepath in os.listdir("generators"):
-    if not gamepath.endswith(".jsonc") or gamepath.startswith("_"): continue
-    with open(f"generators/{gamepath}", encoding="utf-8") as f:
-        game_name = os.path.splitext(gamepath)[0]
-        ALL[game_name] = {name: _create_gen(name, gendict | {"game": game_name}) for name, gendict in jsonc.load(f).items()}
+ALL: dict[str, dict[str, "T_GENERATOR"]] = load_catalogs()
@@ -1,3 +1,4 @@
+import sys
 from typing import Union, TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -33,50 +34,51 @@ def parse_goal(id, goal: dict) -> "T_GOAL":
 # Goal types
 
 class BaseGoal():
-    def __init__(self, id, name, translations: dict[str, str] = {}, **params) -> None:
-        self.id = id
-        self.name = name
-        self.marks: set[int] = set()
-        self.translations = translations
-        self.__dict__.update(params)
-    
-    def mark(self, teamId):
-        if teamId in self.marks: return False
-        self.marks.add(teamId)
-        return True
-    
-    def unmark(self, teamId):
-        if teamId not in self.marks: return False
-        self.marks.remove(teamId)
-        return True
+    """Immutable goal definition, shared by every board that samples it. Marks live on the board."""
+    __slots__ = ("id", "name", "translations", "weight", "exclusions", "params", "_repr")
+
+    def __init__(self, id, name, translations: dict[str, str] = {}, weight=None, exclusions=(), **params) -> None:
+        init = super().__setattr__
+        init("id", sys.intern(str(id)))
+        init("name", sys.intern(name))
+        init("translations", {sys.intern(lang): sys.intern(t) for lang, t in translations.items()})
+        init("weight", weight)
+        init("exclusions", frozenset(sys.intern(e) for e in exclusions))
+        init("params", params)
+        init("_repr", {"name": self.name, "translations": self.translations})
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
     def __str__(self) -> str:
         return self.name
 
     def get_repr(self) -> dict:
-        return {"name": self.name, "translations": self.translations}
-    
+        """Shared between every view of this goal, so callers must not modify it."""
+        return self._repr
+
+# Subclasses only tag a goal's behaviour for the generators; BaseGoal holds every field.
+
 class WeightedGoal(BaseGoal):
-    def __init__(self, weight, **params) -> None:
-        self.weight = weight
-        super().__init__(**params)
+    __slots__ = ()
 
 class ExclusionGoal(BaseGoal):
-    def __init__(self, exclusions: set[str] = set(), **params) -> None:
-        self.exclusions = exclusions
-        super().__init__(**params)
+    __slots__ = ()
 
 class WeightedExclusionGoal(ExclusionGoal, WeightedGoal):
-    pass
+    __slots__ = ()
 
 class TiebreakerGoal(BaseGoal):
-    pass
+    __slots__ = ()
 
 class TiebreakerExclusionGoal(ExclusionGoal, TiebreakerGoal):
-    pass
+    __slots__ = ()
 
 class WeightedTiebreakerExclusionGoal(WeightedExclusionGoal, TiebreakerGoal):
-    pass
+    __slots__ = ()
 
 class WeightedTiebreakerGoal(WeightedGoal, TiebreakerGoal):
-    pass
+    __slots__ = ()
@@ -0,0 +1,40 @@
+"""Room state handed from a draining server process to its replacement.
+
+    python socket_handler.py --handoff rooms.json
+
+On SIGTERM the server saves its rooms to the file before sending clients away; on startup it loads them from it
+(if it exists) before listening. Boards are regenerated from their generator and seed, so only marks, teams and
+users are stored."""
+from datetime import datetime, timezone
+import json
+import logging
+import os
+
+from rooms import Room, restore_room
+
+FORMAT = 2  # Bumped when `Room.get_state` changes incompatibly
+
+_log = logging.getLogger("byngosink")
+
+def save(path: str, rooms: dict[str, Room]):
+    data = {"format": FORMAT, "saved": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "rooms": [room.get_state() for room in rooms.values()]}
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f: json.dump(data, f)
+    os.replace(f"{path}.tmp", path)  # The next process never sees a half-written file
+
+def load(path: str) -> dict[str, Room]:
+    """Rooms saved at `path`, which is then removed so a later restart without a drain doesn't bring them back."""
+    with open(path, encoding="utf-8") as f: data = json.load(f)
+    os.remove(path)
+    if data.get("format", None) != FORMAT:
+        _log.warning(f"Handoff format {data.get('format', None)} not supported: no rooms restored")
+        return {}
+
+    rooms = {}
+    for state in data["rooms"]:
+        try: room = restore_room(state)
+        except Exception as e:  # eg its generator is gone from this build
+            _log.warning(f"Room {state.get('id', None)} not restored | {e!r}")
+            continue
+        rooms[room.id] = room
+    return rooms
@@ -0,0 +1,67 @@
+"""Read-only HTTP snapshots served from the websocket server's `process_request` hook.
+
+    GET /rooms                   lobby, as in LISTED
+    GET /rooms/<id>/spectator    spectator UPDATE frame, as sent to WATCH subscribers
+    GET /rooms/<id>/full         full view UPDATE frame
+    GET /stats                   admin diagnostics, as in STATS_REPORT; needs `Authorization: Bearer <token>`.
+                                 ?tracemalloc=1|0 and ?profile=1|0 switch those on or off first
+
+Room responses carry an ETag derived from the room version, so pollers get 304 Not Modified until something changes."""
+from http import HTTPStatus
+from typing import Callable
+from urllib.parse import parse_qsl
+import json
+
+from websockets.datastructures import Headers
+
+from rooms import Room, WATCH_KINDS
+import stats
+
+T_RESPONSE = tuple[HTTPStatus, list[tuple[str, str]], bytes]
+
+BASE_HEADERS = [("Content-Type", "application/json"),
+                ("Cache-Control", "no-cache"),  # Always revalidate; the ETag makes that cheap
+                ("Access-Control-Allow-Origin", "*")]
+
+_lobby_cache: tuple[str, bytes] = ("", b"")
+_bodies: dict[tuple[str, str], tuple[int, bytes]] = {}  # (room id, kind) -> (version, body)
+
+def _respond(request_headers: Headers, etag: str, body: Callable[[], bytes]) -> T_RESPONSE:
+    if etag in request_headers.get("If-None-Match", ""):
+        return HTTPStatus.NOT_MODIFIED, [("ETag", etag)] + BASE_HEADERS[1:], b""
+    return HTTPStatus.OK, [("ETag", etag)] + BASE_HEADERS, body()
+
+def _not_found() -> T_RESPONSE:
+    return HTTPStatus.NOT_FOUND, BASE_HEADERS, b'{"verb": "NOTFOUND"}'
+
+def handle(path: str, request_headers: Headers, rooms: dict[str, Room], lobby: Callable[[], dict]) -> T_RESPONSE | None:
+    """Answers snapshot requests; returns None for anything else so the websocket handshake continues."""
+    parts = path.split("?", 1)[0].strip("/").split("/")
+    if parts[0] not in ("rooms", "stats") or "Upgrade" in request_headers: return None
+    if parts[0] == "stats": return _stats(path, request_headers, rooms)
+
+    if len(parts) == 1:
+        global _lobby_cache
+        etag = f'"lobby-{hash(tuple((rid, r.version, r.watcher_count()) for rid, r in rooms.items())) & 0xFFFFFFFF:x}"'
+        if _lobby_cache[0] != etag:
+            _lobby_cache = (etag, json.dumps(lobby()).encode())
+        return _respond(request_headers, etag, lambda: _lobby_cache[1])
+
+    room = rooms.get(parts[1], None)
+    if room is None or len(parts) != 3 or parts[2] not in WATCH_KINDS: return _not_found()
+    kind = parts[2]
+    return _respond(request_headers, f'"{room.id}-{room.version}-{kind}"', lambda: _room_body(room, kind))
+
+def _stats(path: str, request_headers: Headers, rooms: dict[str, Room]) -> T_RESPONSE:
+    scheme, _, token = request_headers.get("Authorization", "").partition(" ")
+    if scheme != "Bearer" or not stats.authorised(token):
+        return HTTPStatus.UNAUTHORIZED, BASE_HEADERS, b'{"verb": "NOAUTH"}'
+    try: report = stats.apply(dict(parse_qsl(path.partition("?")[2])), rooms)
+    except ValueError as e: return HTTPStatus.BAD_REQUEST, BASE_HEADERS, json.dumps({"verb": "ERROR", "message": str(e)}).encode()
+    return HTTPStatus.OK, BASE_HEADERS, json.dumps(report).encode()
+
+def _room_body(room: Room, kind: str) -> bytes:
+    cached = _bodies.get((room.id, kind), None)
+    if cached is None or cached[0] != room.version:
+        cached = _bodies[(room.id, kind)] = (room.version, room.encoded_view(kind).encode())
+    return cached[1]
@@ -0,0 +1,10 @@
+"""Process-wide counters for server behaviour worth watching in production."""
+from collections import Counter
+
+counters: Counter[str] = Counter()
+
+def incr(name: str, n: int = 1):
+    counters[name] += n
+
+def snapshot() -> dict[str, int]:
+    return dict(sorted(counters.items()))
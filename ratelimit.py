@@ -0,0 +1,75 @@
+from time import monotonic
+from typing import NamedTuple
+
+class Limit(NamedTuple):
+    rate: float   # Tokens regained per second
+    burst: float  # Bucket capacity
+
+# Keys are verbs, or "<verb>:<board family>" where a verb costs more on some boards.
+# Anything not listed falls back to "default".
+CONNECTION_LIMITS: dict[str, Limit] = {
+    "default": Limit(10, 20),
+    "LIST": Limit(2, 10),
+    "GET_GAMES": Limit(2, 10),
+    "GET_GENERATORS": Limit(2, 10),
+    "OPEN": Limit(0.2, 3),
+    "OPEN_FIXED": Limit(0.2, 3),
+    "GENERATE": Limit(2, 64),  # Charged per seed
+    "BATCH": Limit(0.5, 3),  # On top of its ops
+    "MARK": Limit(10, 20),
+    "UNMARK": Limit(5, 10),
+    "UNMARK:Invasion": Limit(1, 5),  # Each unmark replays the whole board
+}
+
+ROOM_LIMITS: dict[str, Limit] = {
+    "default": Limit(50, 100),
+    "MARK": Limit(30, 60),
+    "UNMARK": Limit(10, 30),
+    "UNMARK:Invasion": Limit(3, 10),
+}
+
+ENABLED = True  # Off only for benchmarks, eg replaying recorded traffic at full speed
+MAX_DELAY = 0.5  # Requests that would have to wait longer than this many seconds are rejected instead
+
+class TokenBucket():
+    """Tokens may go negative: a request costing more than a full bucket is let through once the bucket is full,
+    and the debt makes later requests wait as long as if it had been paid up front."""
+    def __init__(self, limit: Limit) -> None:
+        self.limit = limit
+        self.tokens = limit.burst
+        self.updated = monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.limit.burst, self.tokens + (now - self.updated) * self.limit.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until `cost` tokens can be taken: until they are available, or the bucket is full for larger costs."""
+        needed = min(cost, self.limit.burst)
+        if self.tokens >= needed: return 0
+        if self.limit.rate <= 0: return float("inf")
+        return (needed - self.tokens) / self.limit.rate
+
+class RateLimiter():
+    """A set of token buckets, one per key, created on first use."""
+    def __init__(self, limits: dict[str, Limit]) -> None:
+        self.limits = limits
+        self.buckets: dict[str, TokenBucket] = {}
+
+    def bucket(self, key: str) -> TokenBucket:
+        bucket = self.buckets.get(key, None)
+        if bucket is None:
+            limit = self.limits.get(key, None) or self.limits.get(key.split(":")[0], None) or self.limits["default"]
+            bucket = self.buckets[key] = TokenBucket(limit)
+        return bucket
+
+    def wait_time(self, costs: dict[str, float]) -> float:
+        """Seconds until `costs` could all be taken from their buckets (0 if they can be now)."""
+        buckets = [(self.bucket(key), cost) for key, cost in costs.items()]
+        now = monotonic()  # After creating buckets, which start full as of now
+        for bucket, _ in buckets: bucket.refill(now)
+        return max((bucket.wait_time(cost) for bucket, cost in buckets), default=0)
+
+    def take(self, costs: dict[str, float]):
+        """Takes `costs` from their buckets in full, possibly into debt; check `wait_time` first."""
+        for key, cost in costs.items(): self.bucket(key).tokens -= cost
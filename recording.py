@@ -0,0 +1,73 @@
+"""Opt-in recording of client traffic, so production sessions can be replayed as benchmarks (see replay.py).
+
+    python socket_handler.py --record traffic.rec
+
+A recording is a header followed by records:
+
+    header  "BYNGOREC" | u8 format | f64 start (unix time)
+    record  u8 kind | u32 connection | f64 seconds since start | u32 length | payload (UTF-8 JSON)
+
+Inbound frames are stored as received, except admin ones. Of outbound frames only the verb and new IDs of
+those handing some out are stored (see `id_messages`), so a replay can map recorded IDs onto the ones the replaying
+server hands out."""
+from typing import Iterator
+import json
+import struct
+import time
+
+MAGIC = b"BYNGOREC"
+FORMAT = 1
+HEADER = struct.Struct("<8sBd")
+RECORD = struct.Struct("<BIdI")
+
+CONNECT, INBOUND, OUTBOUND, DISCONNECT = 1, 2, 3, 4
+ID_FIELDS = {"OPENED": ("roomId", "userId"), "OPENED_FIXED": ("roomId",),
+             "JOINED": ("userId",), "TEAM_CREATED": ("teamId",)}  # Outbound verb -> fields holding new IDs
+UNRECORDED_VERBS = frozenset(("STATS",))  # Carry the admin token
+
+def id_messages(message: dict) -> list[dict]:
+    """The replies in `message` that hand out IDs, including those among a BATCHED reply's results."""
+    if message.get("verb", None) == "BATCHED":
+        results = [r for result in message["results"] for r in (result if isinstance(result, list) else [result])]
+        return [r for r in results if isinstance(r, dict) and r.get("verb", None) in ID_FIELDS]
+    return [message] if message.get("verb", None) in ID_FIELDS else []
+
+class Recorder():
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, FORMAT, time.time()))
+        self._started = time.monotonic()
+        self._connections = 0
+
+    def _write(self, kind: int, connection: int, payload: str = ""):
+        data = payload.encode()
+        self.file.write(RECORD.pack(kind, connection, time.monotonic() - self._started, len(data)))
+        self.file.write(data)
+
+    def connected(self) -> int:
+        """Records a new connection and returns its number."""
+        self._connections += 1
+        self._write(CONNECT, self._connections)
+        return self._connections
+
+    def inbound(self, connection: int, frame: str): self._write(INBOUND, connection, frame)
+    def outbound(self, connection: int, message: dict):
+        """Records the IDs an outbound message hands out, if any."""
+        for reply in id_messages(message):
+            self._write(OUTBOUND, connection, json.dumps({field: reply[field] for field in ("verb",) + ID_FIELDS[reply["verb"]]}))
+    def disconnected(self, connection: int): self._write(DISCONNECT, connection)
+
+    def close(self): self.file.close()
+
+active: Recorder | None = None
+
+def read(path: str) -> Iterator[tuple[int, int, float, str]]:
+    """(kind, connection, seconds since start, payload) for each record in a recording."""
+    with open(path, "rb") as f:
+        magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT: raise ValueError(f"{path} is not a format {FORMAT} recording")
+        while len(header := f.read(RECORD.size)) == RECORD.size:
+            kind, connection, t, length = RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length: return  # Cut off mid-record, eg by a crash
+            yield kind, connection, t, payload.decode()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""Replays a traffic recording (see recording.py) against a server and reports latency and server CPU.
+
+    python replay.py traffic.rec                          # local server, recorded pace
+    python replay.py traffic.rec --speed 0 -o replay.json # full speed
+    python replay.py traffic.rec --url ws://host:555/     # an already running server (no CPU figures)
+
+At full speed frames are sent one at a time in recorded order, each as soon as the previous one has its reply,
+so runs are deterministic and time only the server. The local server is started without rate limits, so they
+aren't throttled either. Room, user and team IDs in the recording are mapped onto the ones the replaying server
+hands out; a frame referring to an ID waits until the reply creating it has arrived."""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict, deque
+
+from websockets.client import connect
+
+import recording
+from throughput import cpu_seconds, free_port, start_server, stop_server
+
+# Verb -> replies that complete it, for latency. Verbs without a reply of their own aren't timed.
+REPLIES = {"OPEN": {"OPENED"}, "OPEN_FIXED": {"OPENED_FIXED"}, "JOIN": {"JOINED"}, "REJOIN": {"REJOINED"},
+           "LIST": {"LISTED"}, "GET_GAMES": {"GAMES"}, "GET_GENERATORS": {"GENERATORS"}, "GENERATE": {"GENERATED"},
+           "CREATE_TEAM": {"TEAM_CREATED"}, "JOIN_TEAM": {"TEAM_JOINED"}, "BATCH": {"BATCHED"},
+           "MARK": {"MARKED", "NOMARK"}, "UNMARK": {"UNMARKED", "NOUNMARK"}}
+FAILURES = {"ERROR", "NOTFOUND", "NOAUTH", "NOTEAM", "RATELIMITED"}
+ID_TIMEOUT = 10.0  # Seconds to wait for an ID before sending the recorded one as is
+
+class Replay():
+    def __init__(self, path: str, url: str, speed: float) -> None:
+        self.url = url
+        self.speed = speed
+        self.connections: dict[int, list[tuple[int, float, int, str]]] = defaultdict(list)  # (order, t, kind, payload)
+        self.expected: dict[tuple[int, str], deque[dict]] = defaultdict(deque)  # (connection, verb) -> recorded replies
+        self.ids: dict[str, str] = {}  # Recorded ID -> replayed ID
+        self.ready: dict[str, asyncio.Event] = {}  # Recorded IDs the session hands out
+        self.frames = 0
+        for kind, connection, t, payload in recording.read(path):
+            if kind == recording.OUTBOUND:
+                data = json.loads(payload)
+                self.expected[(connection, data["verb"])].append(data)
+                for field in recording.ID_FIELDS[data["verb"]]: self.ready[data[field]] = asyncio.Event()
+            else:
+                self.connections[connection].append((self.frames, t, kind, payload))
+                self.frames += 1
+        self.turns = [asyncio.Event() for _ in range(self.frames + 1)]  # Full speed: set when a frame may go
+        self.turns[0].set()
+
+        self.sent = 0
+        self.received: Counter[str] = Counter()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.unmapped = 0
+
+    async def remap(self, value):
+        if isinstance(value, dict): return {k: await self.remap(v) for k, v in value.items()}
+        if isinstance(value, list): return [await self.remap(v) for v in value]
+        if isinstance(value, str) and value in self.ready:
+            try: await asyncio.wait_for(self.ready[value].wait(), ID_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.unmapped += 1
+                self.ready[value].set()  # Don't wait again
+            return self.ids.get(value, value)
+        return value
+
+    def learn(self, connection: int, data: dict):
+        expected = self.expected[(connection, data["verb"])]
+        if not expected: return
+        recorded = expected.popleft()
+        for field in recording.ID_FIELDS[data["verb"]]:
+            self.ids[recorded[field]] = data[field]
+            self.ready[recorded[field]].set()
+
+    async def listen(self, connection: int, ws, waiting: deque, idle: asyncio.Event):
+        async for message in ws:
+            data = json.loads(message)
+            verb = data["verb"]
+            self.received[verb] += 1
+            for reply in recording.id_messages(data): self.learn(connection, reply)
+            if waiting and (verb in REPLIES[waiting[0][0]] or verb in FAILURES):
+                sent_verb, started = waiting.popleft()
+                self.latencies[sent_verb].append(time.perf_counter() - started)
+                if not waiting: idle.set()
+
+    async def connection(self, connection: int, start: float):
+        loop = asyncio.get_running_loop()
+        ws, listener, waiting, idle = None, None, deque(), asyncio.Event()
+        idle.set()
+        for order, t, kind, payload in self.connections[connection]:
+            if self.speed > 0: await asyncio.sleep(max(0, start + t / self.speed - loop.time()))
+            else: await self.turns[order].wait()
+            if kind == recording.CONNECT:
+                ws = await connect(self.url, max_size=None)
+                listener = asyncio.create_task(self.listen(connection, ws, waiting, idle))
+            elif kind == recording.INBOUND and ws is not None:
+                data = await self.remap(json.loads(payload))
+                if data.get("verb", None) in REPLIES:
+                    waiting.append((data["verb"], time.perf_counter()))
+                    idle.clear()
+                await ws.send(json.dumps(data))
+                self.sent += 1
+                if self.speed == 0: await self.settle(idle)
+            elif kind == recording.DISCONNECT and ws is not None:
+                await self.settle(idle)  # The recorded client had its replies (and any IDs in them) before leaving
+                await ws.close()
+                await listener
+                ws = None
+            self.turns[order + 1].set()
+        if ws is not None:
+            await ws.close()
+            await listener
+
+    async def settle(self, idle: asyncio.Event):
+        """Waits until everything sent on a connection has its reply."""
+        try: await asyncio.wait_for(idle.wait(), ID_TIMEOUT)
+        except asyncio.TimeoutError: pass
+
+    async def run(self) -> float:
+        started = time.perf_counter()
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*[self.connection(c, start) for c in self.connections])
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        latency = {}
+        for verb, times in sorted(self.latencies.items()):
+            times.sort()
+            latency[verb] = {"count": len(times), "p50Ms": round(statistics.median(times) * 1e3, 3),
+                             "p99Ms": round(times[int(len(times) * 0.99)] * 1e3, 3), "maxMs": round(times[-1] * 1e3, 3)}
+        return {"seconds": round(elapsed, 3), "connections": len(self.connections), "sent": self.sent,
+                "received": dict(self.received.most_common()), "failures": sum(self.received[v] for v in FAILURES),
+                "unmappedIds": self.unmapped, "latency": latency}
+
+async def main_async(args: argparse.Namespace) -> dict:
+    server = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f"ws://127.0.0.1:{port}/"
+        server = await start_server(["--no-rate-limits", "--port", str(port)] + args.server_args, lambda: connect(url))
+    try:
+        replay = Replay(args.recording, url, args.speed)
+        cpu_start = cpu_seconds(server.pid) if server else None
+        elapsed = await replay.run()
+        cpu_end = cpu_seconds(server.pid) if server else None
+    finally:
+        if server is not None: stop_server(server)
+
+    result = replay.report(elapsed)
+    if cpu_start is not None and cpu_end is not None:
+        result["serverCpuSeconds"] = round(cpu_end - cpu_start, 3)
+        result["serverCpuPerFrameMs"] = round((cpu_end - cpu_start) / max(replay.sent, 1) * 1e3, 3)
+    return result
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, default=1, help="multiple of the recorded pace; 0 replays at full speed")
+    parser.add_argument("--url", help="replay against this server instead of starting one")
+    parser.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                        help="options for the local server, eg --loop uvloop (must come last)")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(main_async(args))
+    print(f"{result['sent']} frames over {result['connections']} connections in {result['seconds']}s, "
+          f"{result['failures']} failures, {result['unmappedIds']} unmapped IDs")
+    if "serverCpuSeconds" in result:
+        print(f"server cpu {result['serverCpuSeconds']}s ({result['serverCpuPerFrameMs']}ms per frame)")
+    for verb, l in result["latency"].items():
+        print(f"{verb:<16} {l['count']:7d} p50 {l['p50Ms']:8.3f}ms p99 {l['p99Ms']:8.3f}ms max {l['maxMs']:8.3f}ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"recording": args.recording, "speed": args.speed, "results": result}, f, indent=4)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
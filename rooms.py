@@ -1,19 +1,34 @@
 from random import random
 from uuid import uuid4
-from time import time
+from time import thread_time_ns, time
+from collections import Counter, deque
+import asyncio
+import json
 import logging
+import math
 
-from boards import create_board
+from boards import Board, board_alias, create_board
 from generators import get_generator
+from ratelimit import RateLimiter, ROOM_LIMITS
+import metrics
 
-from typing import Union, TYPE_CHECKING
+from typing import Callable, Union, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from socket_handler import DecoratedWebsocket
     T_WEBSOCKET = Union[DecoratedWebsocket, None]
+    T_COMMAND = Callable[[], Union[dict, None]]
 
 _log = logging.getLogger("byngosink")
 
+COALESCE_WINDOW = 0.005  # Seconds to gather changes before broadcasting them
+MAX_COALESCE_WINDOW = 0.1
+EVENT_BUFFER_SIZE = 256  # Board events kept per room for REJOIN resumes
+WATCH_KINDS = ("spectator", "full")
+MAX_WATCH_INTERVAL = 10.0  # Seconds
+WATCH_BUFFER_LIMIT = 2**20  # Bytes queued for a watcher beyond which it misses frames until it catches up
+FIXED_SEED = "0"
+
 COLOURS = {
     "Pink": "#cc6e8f",
     "Red": "#FF0000",
@@ -29,8 +44,11 @@ COLOURS = {
 
 class Room():
     class User():
+        __slots__ = ("id", "publicId", "name", "socket", "room", "teamId", "spectate")
+
         def __init__(self, name: str, room, websocket: "T_WEBSOCKET" = None) -> None:
-            self.id = str(uuid4())
+            self.id = str(uuid4())  # Secret: REJOIN/EXIT authenticate with it
+            self.publicId = uuid4().hex[:12]  # Identifies the user to other room members
             self.name = name
             self.socket = websocket
             self.room = room
@@ -44,9 +62,11 @@ class Room():
             websocket.set_user(self)
         
         def view(self):
-            return {"name": self.name, "connected": self.socket is not None, "teamId": self.teamId}
+            return {"id": self.publicId, "name": self.name, "connected": self.socket is not None, "teamId": self.teamId}
     
     class Team():
+        __slots__ = ("id", "name", "colour", "members")
+
         def __init__(self, name, colour) -> None:
             self.id = str(uuid4())
             self.name = name
@@ -59,33 +79,250 @@ class Room():
         def view(self):
             return {"id": self.id, "name": self.name, "colour": self.colour, "members": [m.view() for m in self.members]}
     
-    def __init__(self, name, game, generator_str, board_str, seed) -> None:
+    def __init__(self, name, game, generator_str, board_str, seed, board: Board | None = None) -> None:
+        """`board`, if given, was already generated from the other arguments (eg off the event loop)."""
         self.id = str(uuid4())
         self.name = name
         self.spectators = Room.Team("spectator", "#FFFFFF")
         self.teams: dict[str, Room.Team] = {}
         self.users: dict[str, Room.User] = {}
-        self.generate_board(game, generator_str, board_str, seed)
+        self.limiter = RateLimiter(ROOM_LIMITS)
+        if board is None: self.generate_board(game, generator_str, board_str, seed)
+        else: self.set_board(board)
         self.created = int(time())
         self.touch()
+        self._init_actor()
+
+    def _init_actor(self):
+        self._inbox: asyncio.Queue[tuple["T_WEBSOCKET", "T_COMMAND", asyncio.Future]] | None = None
+        self._actor: asyncio.Task | None = None
+        self._board_changes = 0
+        self._member_changes = 0
+        self._member_deltas: list[dict] = []
+        self._members_snapshot = False  # Whether a change since the last flush has no delta
+        self.coalesce_window = COALESCE_WINDOW
+        self.metrics: Counter[str] = Counter()
+        self.version = 0  # Bumped on every change to the board or members
+        self.events: deque[dict] = deque(maxlen=EVENT_BUFFER_SIZE)
+        self._evicted = 0  # Clients on a version older than this can't resume from `events`
+        self.watchers: dict[str, set["DecoratedWebsocket"]] = {kind: set() for kind in WATCH_KINDS}
+        self.watch_interval = 0.0  # Seconds between watcher frames; 0 sends them with every broadcast
+        self._watch_handle: asyncio.TimerHandle | None = None
+        self._frames: dict[str, tuple[int, str]] = {}  # kind -> (version, encoded UPDATE)
+        self._announcements: list[str] = []
+    
+    def submit(self, websocket: "T_WEBSOCKET", command: "T_COMMAND") -> asyncio.Future:
+        """Queues `command` on this room's actor task.
+
+        Commands run in submission order with exclusive access to the room, and must not await.
+        The dict or pre-encoded str (or list of them) a command returns is sent to `websocket` once its batch has been applied;
+        the future resolves to that reply (or raises what the command raised)."""
+        if self._actor is None or self._actor.done():
+            self._inbox = asyncio.Queue()
+            self._actor = asyncio.create_task(self._run(), name=f"room-{self.id}")
+        future = asyncio.get_running_loop().create_future()
+        self._inbox.put_nowait((websocket, command, future))
+        return future
+
+    def board_changed(self, event: dict | None = None):
+        """Flags the board for broadcast and records `event` for resuming clients.
+
+        A change without an event can't be replayed, so clients from before it must take a snapshot."""
+        self._board_changes += 1
+        self.version += 1
+        if event is None:
+            self._evicted = self.version
+            return
+        self._record(event)
+
+    def _record(self, event: dict):
+        if len(self.events) == self.events.maxlen: self._evicted = self.events[0]["seq"]
+        self.events.append({"seq": self.version} | event)
+
+    def announce(self, message: dict):
+        """Sends `message` to every user and watcher with the next broadcast, encoded once.
+        
+        It is also kept in `events` (with `verb` as its `type`) for resuming clients."""
+        self._announcements.append(json.dumps(message))
+        self._record({"type": message["verb"]} | {k: v for k, v in message.items() if k != "verb"})
+
+    def members_changed(self, *deltas: dict):
+        """Flags member changes for broadcast as `deltas`, or as a full MEMBERS snapshot if none are given.
+
+        Deltas set state rather than adjust it, so they can be replayed over a newer snapshot."""
+        self._member_changes += 1
+        self.version += 1
+        if deltas: self._member_deltas.extend(deltas)
+        else: self._members_snapshot = True
+
+    def events_since(self, version: int) -> list[dict] | None:
+        """Board events after `version`, or None if some of them are no longer buffered."""
+        if version < self._evicted or version > self.version: return None
+        return [e for e in self.events if e["seq"] > version]
+
+    async def _run(self):
+        """Applies queued commands and sends their replies immediately.
+
+        Nothing here waits on the network: frames are queued on each socket (see `DecoratedWebsocket.post`),
+        so a client that stops reading can't stall the room. Broadcasts are held for `coalesce_window` seconds after the first change,
+        so every change in that window goes out as a single UPDATE/MEMBERS per user."""
+        loop = asyncio.get_running_loop()
+        deadline = None
+        while True:
+            batch = []
+            if deadline is None:
+                batch.append(await self._inbox.get())
+            else:
+                try: batch.append(await asyncio.wait_for(self._inbox.get(), deadline - loop.time()))
+                except asyncio.TimeoutError: pass
+            while not self._inbox.empty(): batch.append(self._inbox.get_nowait())
+
+            started = thread_time_ns()
+            replies = []
+            for websocket, command, future in batch:
+                try:
+                    replies.append((websocket, command(), future))
+                except Exception as e:
+                    if not future.done(): future.set_exception(e)
+            self.metrics["cpu.ns"] += thread_time_ns() - started
+
+            for websocket, reply, future in replies:
+                if reply is not None and websocket is not None and not websocket.closed:
+                    try:
+                        for message in (reply if isinstance(reply, list) else [reply]):
+                            if isinstance(message, str): websocket.post(message, suppress_log=True)
+                            else: websocket.post_json(message)
+                    except Exception as e: _log.warning(f"Reply failed | {e!r}")
+                if not future.done(): future.set_result(reply)
+
+            if deadline is None and (self._board_changes or self._member_changes):
+                deadline = loop.time() + self.coalesce_window
+            if deadline is not None and loop.time() >= deadline:
+                deadline = None
+                started = thread_time_ns()
+                try: self.flush()
+                except Exception as e: _log.error(e, exc_info=True)
+                self.metrics["cpu.ns"] += thread_time_ns() - started
+                if self._board_changes or self._member_changes:  # e.g. dead sockets found while flushing
+                    deadline = loop.time() + self.coalesce_window
+
+    def flush(self):
+        """Sends the broadcasts owed by commands applied since the last flush."""
+        board_changes, member_changes = self._board_changes, self._member_changes
+        self._board_changes = self._member_changes = 0
+        if board_changes:
+            self.alert_watchers()
+            self._count_broadcast("board", board_changes)
+            self.alert_board_changes()
+        if self._announcements:
+            announcements, self._announcements = self._announcements, []
+            sockets = [user.socket for user in self.connected_users().values()]
+            sockets.extend(socket for watchers in self.watchers.values() for socket in watchers)
+            for message in announcements: self._broadcast(sockets, message)
+        if member_changes:
+            deltas, self._member_deltas = self._member_deltas, []
+            snapshot, self._members_snapshot = self._members_snapshot, False
+            self._count_broadcast("members", member_changes)
+            if snapshot: self.alert_player_changes()
+            else: self.alert_member_deltas(deltas)
+
+    def _broadcast(self, sockets, message: str):
+        """Queues `message`, encoded once, on every socket without awaiting (see `DecoratedWebsocket.post`)."""
+        for socket in sockets: socket.post(message, suppress_log=True)
+
+    def _count_broadcast(self, kind: str, changes: int):
+        for name, n in ((f"broadcasts.{kind}.sent", 1), (f"broadcasts.{kind}.saved", changes - 1)):
+            self.metrics[name] += n
+            metrics.incr(name, n)
+
+    def encoded_view(self, kind: str) -> str:
+        """The UPDATE frame for a read-only view of the board, encoded once per room version."""
+        cached = self._frames.get(kind, None)
+        if cached is not None and cached[0] == self.version: return cached[1]
+
+        board = self.board.get_spectator_view() if kind == "spectator" else self.board.get_full_view()
+        frame = json.dumps({"verb": "UPDATE", "board": board,
+                            "teamColours": {id: team.colour for id, team in self.teams.items()}, "seq": self.version})
+        self._frames[kind] = (self.version, frame)
+        return frame
+
+    def watch(self, websocket: "DecoratedWebsocket", kind: str):
+        self.unwatch(websocket)
+        self.watchers[kind].add(websocket)
+        websocket.watching = self
+
+    def unwatch(self, websocket: "DecoratedWebsocket"):
+        for sockets in self.watchers.values(): sockets.discard(websocket)
+        if websocket.watching is self: websocket.watching = None  # Still needed to unwatch another room on disconnect
+
+    def watcher_count(self) -> int:
+        return sum(len(sockets) for sockets in self.watchers.values())
+
+    def alert_watchers(self):
+        """Sends watchers the shared encoded frames, at most once per `watch_interval`."""
+        if not self.watcher_count() or self._watch_handle is not None: return
+        if self.watch_interval <= 0:
+            self._send_watchers()
+        else:
+            self._watch_handle = asyncio.get_running_loop().call_later(self.watch_interval, self._send_watchers)
+
+    def _send_watchers(self):
+        self._watch_handle = None
+        for kind, sockets in self.watchers.items():
+            # Each frame is a whole view, so a watcher that is behind only needs the latest one
+            # (well before it would be cut off for falling too far behind)
+            ready = [s for s in sockets if s.transport.get_write_buffer_size() <= WATCH_BUFFER_LIMIT]
+            if len(ready) < len(sockets):
+                self.metrics["watchers.skipped"] += len(sockets) - len(ready)
+                metrics.incr("watchers.skipped", len(sockets) - len(ready))
+            if ready: self._broadcast(ready, self.encoded_view(kind))
+
+    def set_watch_interval(self, ms: float):
+        if not math.isfinite(ms): raise ValueError(f"watchIntervalMs must be finite, not {ms}")
+        self.watch_interval = min(max(ms, 0), MAX_WATCH_INTERVAL * 1000) / 1000
+
+    def set_coalesce_window(self, ms: float):
+        if not math.isfinite(ms): raise ValueError(f"coalesceMs must be finite, not {ms}")
+        self.coalesce_window = min(max(ms, 0), MAX_COALESCE_WINDOW * 1000) / 1000
     
     def add_user(self, user_name: str, socket=None) -> str:
         user = Room.User(user_name, self, socket)
         self.users[user.id] = user
         return user.id
 
+    def drop_socket(self, user: User):
+        """Detaches a dead socket from `user`; the rest of the room hears about it in the next flush."""
+        user.socket = None
+        self.members_changed({"op": "connection", "userId": user.publicId, "connected": False})
+
     def get_user_by_socket(self, websocket: "DecoratedWebsocket"):
         for user in self.users.values():
             if websocket == user.socket: return user
         return None
     
+    def get_state(self) -> dict:
+        """Everything another process needs to recreate this room (see `restore_room`). Sockets are left behind."""
+        board = self.board
+        return {"id": self.id, "name": self.name, "created": self.created, "touched": self.touched, "version": self.version,
+                "coalesceWindow": self.coalesce_window, "watchInterval": self.watch_interval,
+                "board": {"type": board_alias(board), "game": board.game, "generator": board.generatorName,
+                          "seed": board.seed, "state": board.get_state()},
+                "teams": [{"id": t.id, "name": t.name, "colour": t.colour, "members": [u.id for u in t.members]}
+                          for t in self.teams.values()],
+                "spectators": {"id": self.spectators.id, "members": [u.id for u in self.spectators.members]},
+                "users": [{"id": u.id, "publicId": u.publicId, "name": u.name, "teamId": u.teamId, "spectate": u.spectate}
+                          for u in self.users.values()]}
+
     def touch(self): self.touched = int(time())
     
     def generate_board(self, game, generator_str, board_str, seed):
         if (seed == ""): seed = str(random())
         generator = get_generator(game, generator_str)
-        self.board = create_board(board_str, generator, seed)
-        self.languages = generator.languages
+        self.set_board(create_board(board_str, generator, seed))
+
+    def set_board(self, board: Board):
+        self.board = board
+        self.languages = board.languages
         self.touch()
     
     def create_team(self, name, colour):
@@ -99,44 +336,84 @@ class Room():
             if u.socket is not None: out[k] = u
         return out
 
-    async def alert_board_changes(self):
+    def alert_board_changes(self):
         for user in self.users.values():
             if user.socket is not None:
-                if user.socket.closed: user.socket = None
+                if user.socket.closed: self.drop_socket(user)
                 else:
                     if user.spectate == 0:
-                        await user.socket.send_json({"verb": "UPDATE", "board": self.board.get_team_view(user.teamId),
-                                                    "teamColours": {id: team.colour for id, team in self.teams.items()}})
+                        user.socket.post_json({"verb": "UPDATE", "board": self.board.get_team_view(user.teamId),
+                                                "teamColours": {id: team.colour for id, team in self.teams.items()}, "seq": self.version})
                     elif user.spectate == 1:
-                        await user.socket.send_json({"verb": "UPDATE", "board": self.board.get_spectator_view(),
-                                                    "teamColours": {id: team.colour for id, team in self.teams.items()}})
+                        user.socket.post_json({"verb": "UPDATE", "board": self.board.get_spectator_view(),
+                                                "teamColours": {id: team.colour for id, team in self.teams.items()}, "seq": self.version})
                     else:  # user.spectate == 2
-                        await user.socket.send_json({"verb": "UPDATE", "board": self.board.get_full_view(),
-                                                    "teamColours": {id: team.colour for id, team in self.teams.items()}})
+                        user.socket.post_json({"verb": "UPDATE", "board": self.board.get_full_view(),
+                                                "teamColours": {id: team.colour for id, team in self.teams.items()}, "seq": self.version})
     
-    async def alert_player_changes(self):
-        usersData = [user.view() for user in self.users.values()]
+    def members_message(self) -> dict:
+        return {"verb": "MEMBERS", "members": [user.view() for user in self.users.values()],
+                "teams": {id: team.view() for id, team in self.teams.items()}}
+
+    def alert_member_deltas(self, deltas: list[dict]):
+        message = json.dumps({"verb": "MEMBERS_DELTA", "changes": deltas})
+        self._broadcast([user.socket for user in self.connected_users().values()], message)
+
+    def alert_player_changes(self):
+        message = self.members_message()
 
         for user in self.connected_users().values():
-            if user.socket.closed: user.socket = None
+            if user.socket.closed: self.drop_socket(user)
             else:
-                await user.socket.send_json({"verb": "MEMBERS", "members": usersData,
-                                             "teams": {id: team.view() for id, team in self.teams.items()}})
+                user.socket.post_json(message)
                 
 class FixedRoom(Room):
-    def __init__(self, name, game, board_str, goals) -> None:
+    def __init__(self, name, game, board_str, goals, board: Board | None = None) -> None:
         self.id = str(uuid4())
         self.name = name
         self.spectators = Room.Team("spectator", "#FFFFFF")
         self.teams: dict[str, Room.Team] = {}
         self.users: dict[str, Room.User] = {}
-        self.generate_board(game, board_str, goals)
+        self.limiter = RateLimiter(ROOM_LIMITS)
+        if board is None: self.generate_board(game, board_str, goals)
+        else: self.set_board(board)
         self.created = int(time())
         self.touch()
+        self._init_actor()
+
+    def get_state(self) -> dict:
+        state = super().get_state()
+        state["board"]["goals"] = self.board.generator.goals
+        return state
 
     def generate_board(self, game, board_str, goals):
-        seed = "0"
+        seed = FIXED_SEED
         generator = get_generator(game, "Fixed", goals=goals)
-        self.board = create_board(board_str, generator, seed)
-        self.languages = generator.languages
-        self.touch()
+        self.set_board(create_board(board_str, generator, seed))
+
+def restore_room(state: dict) -> Room:
+    """Recreates a room from `Room.get_state`, with every user disconnected until they REJOIN."""
+    b = state["board"]
+    if "goals" in b:
+        board = create_board(b["type"], get_generator(b["game"], "Fixed", goals=b["goals"]), b["seed"])
+        room = FixedRoom(state["name"], b["game"], b["type"], b["goals"], board=board)
+    else:
+        board = create_board(b["type"], get_generator(b["game"], b["generator"]), b["seed"])
+        room = Room(state["name"], b["game"], b["generator"], b["type"], b["seed"], board=board)
+    board.set_state(b["state"])
+
+    room.id, room.created, room.touched = state["id"], state["created"], state["touched"]
+    room.version = room._evicted = state["version"]  # Buffered events stayed behind, so resumes take a new view
+    room.coalesce_window, room.watch_interval = state["coalesceWindow"], state["watchInterval"]
+    for u in state["users"]:
+        user = Room.User(u["name"], room)
+        user.id, user.publicId, user.teamId, user.spectate = u["id"], u["publicId"], u["teamId"], u["spectate"]
+        room.users[user.id] = user
+    for t in state["teams"]:
+        team = Room.Team(t["name"], t["colour"])
+        team.id = t["id"]
+        team.members = [room.users[uid] for uid in t["members"] if uid in room.users]  # Skips users gone since
+        room.teams[team.id] = team
+    room.spectators.id = state["spectators"]["id"]  # Spectators' teamId
+    room.spectators.members = [room.users[uid] for uid in state["spectators"]["members"] if uid in room.users]
+    return room
@@ -2,13 +2,26 @@
 
 import os
 from typing import Optional
-from websockets import ConnectionClosedError
-from websockets.server import serve, WebSocketServerProtocol
-import asyncio, json, logging
+from websockets import ConnectionClosed, ConnectionClosedError, broadcast
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from websockets.server import serve, unix_serve, WebSocketServer, WebSocketServerProtocol
+import argparse, asyncio, json, logging, math, signal
+from collections import Counter
+from random import random, uniform
 from datetime import datetime
+from time import thread_time_ns
 import ssl
 
+import generation
 import generators
+import handoff
+import http_api
+import metrics
+import ratelimit
+import recording
+import stats
+from boards import Invasion
+from ratelimit import RateLimiter
 from rooms import *
 
 _log = logging.getLogger("byngosink")
@@ -27,34 +40,76 @@ _log.addHandler(fileHandler)
 _log.setLevel(logging.INFO)
 #logging.getLogger("websockets.server").setLevel(logging.INFO)
 
+SEND_BUFFER_LIMIT = 2**22  # Bytes queued for a client by `post` beyond which it is cut off (it can REJOIN)
+
 class DecoratedWebsocket(WebSocketServerProtocol):
     """Provides outbound logging and utility methods"""
+    @property
+    def address(self) -> str:
+        """Client address for logs; on a Unix socket this is taken from the reverse proxy's X-Forwarded-For"""
+        if isinstance(self.remote_address, tuple): return self.remote_address[0]
+        return self.request_headers.get("X-Forwarded-For", "unix").split(",")[0].strip()
+
     def set_user(self, user: Room.User | None):
         self.user = user
     
+    def get_room(self) -> Optional[Room]:
+        if "user" not in self.__dict__ or self.user is None: return None
+        return self.user.room
+
     def clear_self_from_room(self) -> Optional[Room]:
         if "user" not in self.__dict__ or self.user is None: return None
+        if self.user.socket is not self: return None  # User has already rejoined or been dropped
         room = self.user.room
-        self.user.socket = None
+        room.drop_socket(self.user)
         return room
 
     async def send(self, message, suppress_log: bool = False):
-        if not suppress_log: _log.info(f"OUT | {self.remote_address[0]} | {message}")
-        _log.debug(f"OUT | {self.remote_address[0]} | {message}")
+        if not suppress_log: _log.info(f"OUT | {self.address} | {message}")
+        _log.debug(f"OUT | {self.address} | {message}")
         await super().send(message)
+        self._count_sent(message)
     
     async def send_json(self, data: dict):
-        _log.info(f"OUT | {self.remote_address[0]} | {data.get('verb', None)}: {', '.join(data.keys())}")
-        await self.send(json.dumps(data), suppress_log=True)
+        await self.send(self._encode(data), suppress_log=True)
+
+    def post(self, message: str, suppress_log: bool = False):
+        """Queues `message` without waiting for the client to read it, for room actors, which must not await.
+
+        A client more than `SEND_BUFFER_LIMIT` bytes behind is cut off instead of buffering without limit."""
+        if self.transport.is_closing(): return
+        if self.transport.get_write_buffer_size() > SEND_BUFFER_LIMIT:
+            _log.warning(f"!BUF | {self.address}")
+            metrics.incr("send.overflows")
+            self.transport.abort()
+            return
+        if not suppress_log: _log.info(f"OUT | {self.address} | {message}")
+        broadcast([self], message)
+        self._count_sent(message)
+
+    def post_json(self, data: dict):
+        self.post(self._encode(data), suppress_log=True)
+
+    def _encode(self, data: dict) -> str:
+        _log.info(f"OUT | {self.address} | {data.get('verb', None)}: {', '.join(data.keys())}")
+        if recording.active is not None: recording.active.outbound(self.recording_id, data)
+        return json.dumps(data)
+
+    def _count_sent(self, message):
+        metrics.incr("bytes.sent", len(message))
+        room = self.get_room() or getattr(self, "watching", None)
+        if room is not None: room.metrics["bytes.sent"] += len(message)
 
 
 rooms: dict[str, Room] = {}
 
+def lobby() -> dict:
+    return {rid: {"name": r.name, "game": r.board.game, "board": r.board.name,
+                  "variant": r.board.generatorName, "count": len(r.connected_users()), "watchers": r.watcher_count()}
+            for rid, r in rooms.items() if len(r.users) > 0}
+
 async def LIST(websocket: DecoratedWebsocket, data):
-    roomlist = {rid: {"name": r.name, "game": r.board.game, "board": r.board.name,
-                      "variant": r.board.generatorName, "count": len(r.connected_users())}
-                for rid, r in rooms.items() if len(r.users) > 0}
-    await websocket.send_json({"verb": "LISTED", "list": roomlist})
+    await websocket.send_json({"verb": "LISTED", "list": lobby()})
 
 async def GET_GENERATORS(websocket: DecoratedWebsocket, data):
     game = data["game"]
@@ -65,186 +120,193 @@ async def GET_GAMES(websocket: DecoratedWebsocket, data):
     games = list(generators.ALL.keys())
     await websocket.send_json({"verb": "GAMES", "games": games})
 
+def room_options_error(data) -> dict | None:
+    """The ERROR reply for OPEN/OPEN_FIXED options that can't be applied, checked before a board is generated."""
+    if "coalesceMs" in data and not math.isfinite(float(data["coalesceMs"])):
+        return {"verb": "ERROR", "message": "coalesceMs must be a finite number"}
+    if "watchIntervalMs" in data and not math.isfinite(float(data["watchIntervalMs"])):
+        return {"verb": "ERROR", "message": "watchIntervalMs must be a finite number"}
+    return None
+
 async def OPEN(websocket: DecoratedWebsocket, data):
+    if (error := room_options_error(data)) is not None:
+        await websocket.send_json(error)
+        return
     user_name = data["username"]
-    room = Room(data["roomName"], data["game"], data["generator"], data["board"], data["seed"])
+    seed = data["seed"] or str(random())
+    board = await generation.create_board(data["board"], generators.get_generator(data["game"], data["generator"]), seed)
+    room = Room(data["roomName"], data["game"], data["generator"], data["board"], seed, board=board)
+    if "coalesceMs" in data: room.set_coalesce_window(float(data["coalesceMs"]))
+    if "watchIntervalMs" in data: room.set_watch_interval(float(data["watchIntervalMs"]))
     user_id = room.add_user(user_name, websocket)
     rooms[room.id] = room
     
     await websocket.send_json({"verb": "OPENED", "roomId": room.id, "userId": user_id})
 
 async def OPEN_FIXED(websocket: DecoratedWebsocket, data):
-    room = FixedRoom(data["roomName"], data["game"], data["board"], data["goals"])
+    if (error := room_options_error(data)) is not None:
+        await websocket.send_json(error)
+        return
+    generator = generators.get_generator(data["game"], "Fixed", goals=data["goals"])
+    board = await generation.create_board(data["board"], generator, FIXED_SEED)
+    room = FixedRoom(data["roomName"], data["game"], data["board"], data["goals"], board=board)
+    if "coalesceMs" in data: room.set_coalesce_window(float(data["coalesceMs"]))
+    if "watchIntervalMs" in data: room.set_watch_interval(float(data["watchIntervalMs"]))
     rooms[room.id] = room
 
     await websocket.send_json({"verb": "OPENED_FIXED", "roomId": room.id})
 
-async def JOIN(websocket: DecoratedWebsocket, data):
-    room_id = data["roomId"]
-    if room_id not in rooms:
-        await websocket.send('{"verb": "NOTFOUND"}')
+async def STATS(websocket: DecoratedWebsocket, data):
+    """Admin diagnostics; `tracemalloc` and `profile` switch those on or off before reporting."""
+    if not stats.authorised(data.get("token", None)):
+        await websocket.send_json(NOAUTH)
         return
-    room = rooms[room_id]
-    user_id = room.add_user(data["username"], websocket)
-
-    await websocket.send_json({"verb": "JOINED", "userId": user_id, "roomName": room.name,
-                               "languages": room.languages,
-                               "boardMin": room.board.get_minimum_view(),
-                               "teamColours": {id: team.colour for id, team in room.teams.items()}})
-    await room.alert_player_changes()
-
-async def REJOIN(websocket: DecoratedWebsocket, data):
-    user_id = data["userId"]
-    room_id = data["roomId"]
-    if room_id not in rooms:
-        await websocket.send('{"verb": "NOTFOUND"}')
+    try: report = stats.apply(data, rooms)
+    except ValueError as e:
+        await websocket.send_json({"verb": "ERROR", "message": str(e)})
         return
-    room = rooms[room_id]
-    if user_id not in room.users:
-        await websocket.send('{"verb": "NOAUTH"}')
+    await websocket.send_json({"verb": "STATS_REPORT"} | report)
+
+async def GENERATE(websocket: DecoratedWebsocket, data):
+    """Previews the boards for one `seed` or a list of `seeds`, without opening a room."""
+    seeds = data["seeds"] if "seeds" in data else [data["seed"] or str(random())]
+    if len(seeds) > generation.MAX_PREVIEWS:
+        await websocket.send_json({"verb": "ERROR", "message": f"At most {generation.MAX_PREVIEWS} seeds per request"})
         return
+    generators.get_generator(data["game"], data["generator"])  # Fail here rather than in a worker
+    views = await generation.previews(data["game"], data["generator"], data["board"], seeds)
+    await websocket.send_json({"verb": "GENERATED", "boards": views})
+
+NOTFOUND = {"verb": "NOTFOUND"}
+NOAUTH = {"verb": "NOAUTH"}
+NOTEAM = {"verb": "NOTEAM"}
+
+# Room commands run on the room's actor (see `Room.submit`): they must not await,
+# and return the reply for the requesting socket (or None).
+
+def join(room: Room, websocket: DecoratedWebsocket, data):
+    user_id = room.add_user(data["username"], websocket)
+    room.members_changed({"op": "userAdded", "user": room.users[user_id].view()})
+    return [{"verb": "JOINED", "userId": user_id, "roomName": room.name,
+             "languages": room.languages,
+             "boardMin": room.board.get_minimum_view(),
+             "teamColours": {id: team.colour for id, team in room.teams.items()}},
+            room.members_message()]
+
+def rejoin(room: Room, websocket: DecoratedWebsocket, data):
+    """Reattaches a user to a new socket.
+    
+    Clients sending `lastSeq` get only the board events since then, unless they are no longer buffered."""
+    user = room.users.get(data["userId"], None)
+    if user is None: return NOAUTH
     
-    user = room.users[user_id]
+    was_connected = user.socket is not None and not user.socket.closed
     user.change_socket(websocket)
-    await websocket.send_json({"verb": "REJOINED", "roomName": room.name, "languages": room.languages, "boardMin": room.board.get_team_view(user.teamId),
-                               "teamId": user.teamId or "", "teamColours": {id: team.colour for id, team in room.teams.items()}})
-    await room.alert_player_changes()
-
-async def EXIT(websocket: DecoratedWebsocket, data):
-    user_id = data["userId"]
-    room_id = data["roomId"]
-    if room_id not in rooms:
-        await websocket.send('{"verb": "NOTFOUND"}')
-        return
-    room = rooms[room_id]
-    user = room.users.pop(user_id, None)
-    if user is None:
-        await websocket.send('{"verb": "NOAUTH"}')
-        return
+    rejoined = {"verb": "REJOINED", "roomName": room.name, "languages": room.languages,
+                "teamId": user.teamId or "", "teamColours": {id: team.colour for id, team in room.teams.items()}, "seq": room.version}
+
+    events = None
+    if "lastSeq" in data and room.board.resumable and user.spectate == 0:
+        events = room.events_since(int(data["lastSeq"]))
+    if events is None:
+        rejoined["boardMin"] = room.board.get_team_view(user.teamId)
+    else:
+        rejoined["events"] = events
+        extras = room.board.get_extras(user.teamId)
+        if extras is not None: rejoined["extras"] = extras
+
+    if not was_connected: room.members_changed({"op": "connection", "userId": user.publicId, "connected": True})
+    return [rejoined, room.members_message()]
+
+def exit_room(room: Room, websocket: DecoratedWebsocket, data):
+    user = room.users.pop(data["userId"], None)
+    if user is None: return NOAUTH
     
     for team in room.teams.values():
         if team.id == user.teamId:
             team.members.remove(user)
-            await room.alert_player_changes()
-
-async def CREATE_TEAM(websocket: DecoratedWebsocket, data):
-    room_id = data["roomId"]
-    name = data["name"]
-    colour = data["colour"]
-    if room_id not in rooms:
-        await websocket.send('{"verb": "NOTFOUND"}')
-        return
-    room = rooms[room_id]
+    if user in room.spectators.members: room.spectators.remove_user(user)
+    if user.socket is not None and user.socket.user is user:  # Its closing later isn't news to the room
+        user.socket.set_user(None)
+    user.socket = None
+    room.members_changed({"op": "userRemoved", "userId": user.publicId})
+
+def create_team(room: Room, websocket: DecoratedWebsocket, data):
     user = room.get_user_by_socket(websocket)
-    if user is None:
-        await websocket.send('{"verb": "NOAUTH"}')
-        return
+    if user is None: return NOAUTH
     if user.teamId is not None and user.teamId in room.teams:  # If user is already in team, remove them from this team
         room.teams[user.teamId].members.remove(user)
 
-    team = room.create_team(name, colour)
+    team = room.create_team(data["name"], data["colour"])
     team.add_user(user)
     user.teamId = team.id
     user.spectate = False
+    room.members_changed({"op": "teamCreated", "team": {"id": team.id, "name": team.name, "colour": team.colour}},
+                         {"op": "teamChanged", "userId": user.publicId, "teamId": team.id})
+    return {"verb": "TEAM_CREATED", "teamId": team.id,
+            "board": room.board.get_team_view(user.teamId),
+            "teamColours": {id: team.colour for id, team in room.teams.items()}, "seq": room.version}
 
-    await websocket.send_json({"verb": "TEAM_CREATED", "teamId": team.id,
-                               "board": room.board.get_team_view(user.teamId),
-                               "teamColours": {id: team.colour for id, team in room.teams.items()}})
-    await room.alert_player_changes()
-
-async def JOIN_TEAM(websocket: DecoratedWebsocket, data):
-    room_id = data["roomId"]
-    team_id = data["teamId"]
-    if room_id not in rooms:
-        await websocket.send('{"verb": "NOTFOUND"}')
-        return
-    room = rooms[room_id]
+def join_team(room: Room, websocket: DecoratedWebsocket, data):
     user = room.get_user_by_socket(websocket)
-    if user is None:
-        await websocket.send('{"verb": "NOAUTH"}')
-        return
-    team = room.teams.get(team_id, None)
-    if team is None:
-        await websocket.send('{"verb": "NOTFOUND"}')
-        return
+    if user is None: return NOAUTH
+    team = room.teams.get(data["teamId"], None)
+    if team is None: return NOTFOUND
     if user.teamId is not None and user.teamId in room.teams:  # If user is already in team, remove them from this team
         room.teams[user.teamId].members.remove(user)
     team.add_user(user)
     user.teamId = team.id
     user.spectate = False
-    await websocket.send_json({"verb": "TEAM_JOINED", "board": room.board.get_team_view(user.teamId), "teamId": team.id,
-                               "teamColours": {id: team.colour for id, team in room.teams.items()}})
-    await room.alert_player_changes()
-
-async def LEAVE_TEAM(websocket: DecoratedWebsocket, data):
-    room_id = data["roomId"]
-    if room_id not in rooms:
-        await websocket.send('{"verb": "NOTFOUND"}')
-        return
-    room = rooms[room_id]
+    room.members_changed({"op": "teamChanged", "userId": user.publicId, "teamId": team.id})
+    return {"verb": "TEAM_JOINED", "board": room.board.get_team_view(user.teamId), "teamId": team.id,
+            "teamColours": {id: team.colour for id, team in room.teams.items()}, "seq": room.version}
+
+def leave_team(room: Room, websocket: DecoratedWebsocket, data):
     user = room.get_user_by_socket(websocket)
-    if user is None:
-        await websocket.send('{"verb": "NOAUTH"}')
-        return
+    if user is None: return NOAUTH
     for team in room.teams.values():
         if team.id == user.teamId:
             team.members.remove(user)
             user.teamId = None
-            await websocket.send('{"verb": "TEAM_LEFT"}')
-            await room.alert_player_changes()
-            return
+            room.members_changed({"op": "teamChanged", "userId": user.publicId, "teamId": None})
+            return {"verb": "TEAM_LEFT"}
 
-async def get_goal_params(websocket: DecoratedWebsocket, data):
-    room_id = data["roomId"]
-    goal_id = data["goalId"]
-    if room_id not in rooms:
-        await websocket.send('{"verb": "NOTFOUND"}')
-        return None
-    room = rooms[room_id]
+def get_goal_params(room: Room, websocket: DecoratedWebsocket, data):
+    """Returns (user, goal_id), or the reply to send if the request is invalid."""
     user = room.get_user_by_socket(websocket)
-    if user is None:
-        await websocket.send('{"verb": "NOAUTH"}')
-        return None
-    if user.teamId is None:
-        await websocket.send('{"verb": "NOTEAM"}')
-        return None
+    if user is None: return NOAUTH
+    if user.teamId is None: return NOTEAM
 
-    return (user, room, int(goal_id))
+    return (user, int(data["goalId"]))
     
-async def MARK(websocket: DecoratedWebsocket, data):
-    params = await get_goal_params(websocket, data)
-    if params is None: return
-    user, room, goal_id = params
+def mark(room: Room, websocket: DecoratedWebsocket, data):
+    params = get_goal_params(room, websocket, data)
+    if isinstance(params, dict): return params
+    user, goal_id = params
     
     # TODO: Communicate failure in e.g. invasion, lockout, etc.
     if room.board.mark(goal_id, user.teamId):
-        await websocket.send_json({"verb": "MARKED", "goalId": goal_id})
-        await room.alert_board_changes()
+        room.board_changed({"type": "MARK", "goalId": goal_id, "teamId": user.teamId})
+        for event in room.board.pop_events(): room.announce(event)
+        return {"verb": "MARKED", "goalId": goal_id}
     else:
-        await websocket.send_json({"verb": "NOMARK", "goalId": goal_id})
+        return {"verb": "NOMARK", "goalId": goal_id}
     
-async def UNMARK(websocket: DecoratedWebsocket, data):
-    params = await get_goal_params(websocket, data)
-    if params is None: return
-    user, room, goal_id = params
+def unmark(room: Room, websocket: DecoratedWebsocket, data):
+    params = get_goal_params(room, websocket, data)
+    if isinstance(params, dict): return params
+    user, goal_id = params
 
     # TODO: Communicate failure in e.g. invasion, lockout, etc.
-    if room.board.unmark(int(goal_id), user.teamId):
-        await websocket.send_json({"verb": "UNMARKED", "goalId": goal_id})
-        await room.alert_board_changes()
+    if room.board.unmark(goal_id, user.teamId):
+        room.board_changed({"type": "UNMARK", "goalId": goal_id, "teamId": user.teamId})
+        return {"verb": "UNMARKED", "goalId": goal_id}
     else:
-        await websocket.send_json({"verb": "NOUNMARK", "goalId": goal_id})
+        return {"verb": "NOUNMARK", "goalId": goal_id}
 
-async def SPECTATE(websocket: DecoratedWebsocket, data):
-    room_id = data.get("roomId", None)
-    room = rooms.get(room_id, None)
-    if room is None:
-        await websocket.send('{"verb": "NOTFOUND"}')
-        return None
+def spectate(room: Room, websocket: DecoratedWebsocket, data):
     user = room.get_user_by_socket(websocket)
-    if user is None:
-        await websocket.send('{"verb": "NOAUTH"}')
-        return None
+    if user is None: return NOAUTH
     
     if user.spectate == 0:
         user.spectate = 1
@@ -252,57 +314,186 @@ async def SPECTATE(websocket: DecoratedWebsocket, data):
         if user.teamId is not None and user.teamId in room.teams:
             room.teams[user.teamId].members.remove(user)
         user.teamId = room.spectators.id
-
-        await user.socket.send_json({"verb": "UPDATE", "board": room.board.get_spectator_view(),
-                                     "teamColours": {id: team.colour for id, team in room.teams.items()}})
+        room.members_changed({"op": "teamChanged", "userId": user.publicId, "teamId": user.teamId})
+        board = room.board.get_spectator_view()
     elif user.spectate == 1:
-        user.spectate = 2
-        await user.socket.send_json({"verb": "UPDATE", "board": room.board.get_full_view(),
-                                     "teamColours": {id: team.colour for id, team in room.teams.items()}})
+        user.spectate = 2  # Not shown in member views, so no membership change
+        board = room.board.get_full_view()
     else:
-        return  # do nothing if already at max spectator level
-    
-    await room.alert_player_changes()
+        return None  # do nothing if already at max spectator level
     
+    return {"verb": "UPDATE", "board": board,
+            "teamColours": {id: team.colour for id, team in room.teams.items()}, "seq": room.version}
+
+def watch(room: Room, websocket: DecoratedWebsocket, data):
+    """Subscribes a socket to read-only board frames without joining the room as a user."""
+    kind = data.get("view", "spectator")
+    if kind not in WATCH_KINDS: return {"verb": "ERROR", "message": f"Unknown view {kind}"}
+    if websocket.watching is not None and websocket.watching is not room: websocket.watching.unwatch(websocket)
+    room.watch(websocket, kind)
+    return room.encoded_view(kind)
+
+def unwatch(room: Room, websocket: DecoratedWebsocket, data):
+    room.unwatch(websocket)
+
+def disconnect(room: Room, websocket: DecoratedWebsocket, data):
+    websocket.clear_self_from_room()
+
+ROOM_COMMANDS = {"JOIN": join,
+                 "REJOIN": rejoin,
+                 "EXIT": exit_room,
+                 "MARK": mark,
+                 "UNMARK": unmark,
+                 "CREATE_TEAM": create_team,
+                 "JOIN_TEAM": join_team,
+                 "LEAVE_TEAM": leave_team,
+                 "SPECTATE": spectate,
+                 }
+
+MAX_BATCH_OPS = 100
+
+def batch_error(data) -> dict | None:
+    """The ERROR reply for a BATCH whose `ops` can't be run, checked before it is charged to any rate limit."""
+    ops = data.get("ops", None)
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        return {"verb": "ERROR", "message": "Batch ops must be a list of requests"}
+    if len(ops) > MAX_BATCH_OPS:
+        return {"verb": "ERROR", "message": f"Batch exceeds {MAX_BATCH_OPS} operations"}
+    for op in ops:
+        if op.get("verb", None) not in ROOM_COMMANDS:
+            return {"verb": "ERROR", "message": f"Bad verb in batch: {op.get('verb', None)!r}"}
+    return None
+
+def batch(room: Room, websocket: DecoratedWebsocket, data):
+    """Applies `ops`, a list of room command requests, in order as one command, so the room broadcasts once."""
+    if (error := batch_error(data)) is not None: return error
+
+    results = []
+    for op in data["ops"]:
+        command = ROOM_COMMANDS[op["verb"]]
+        try:
+            results.append(command(room, websocket, op | {"roomId": room.id}))
+        except Exception as e:
+            results.append({"verb": "ERROR", "message": f"Server Error: {e.__repr__()}"})
+            _log.error(e, exc_info=True)
+    return {"verb": "BATCHED", "results": results}
+
+def room_handler(command):
+    """Wraps a room command as a verb handler that runs it on the target room's actor."""
+    async def handler(websocket: DecoratedWebsocket, data):
+        room = rooms.get(data.get("roomId", None), None)
+        if room is None:
+            await websocket.send_json(NOTFOUND)
+            return
+        await room.submit(websocket, lambda: timed(data["verb"], command, room, websocket, data))
+    return handler
+
+def timed(verb: str, command, *args):
+    """Runs a room command, adding its CPU time to the verb's metrics."""
+    started = thread_time_ns()
+    try: return command(*args)
+    finally: metrics.incr(f"cpu.verb.{verb}.ns", thread_time_ns() - started)
 
 HANDLERS = {"LIST": LIST,
             "OPEN": OPEN,
             "OPEN_FIXED": OPEN_FIXED,
-            "JOIN": JOIN,
-            "REJOIN": REJOIN,
-            "EXIT": EXIT,
-            "MARK": MARK,
-            "UNMARK": UNMARK,
             "GET_GENERATORS": GET_GENERATORS,
             "GET_GAMES": GET_GAMES,
-            "CREATE_TEAM": CREATE_TEAM,
-            "JOIN_TEAM": JOIN_TEAM,
-            "LEAVE_TEAM": LEAVE_TEAM,
-            "SPECTATE": SPECTATE,
-            }
+            "GENERATE": GENERATE,
+            "STATS": STATS,
+            "BATCH": room_handler(batch),
+            "WATCH": room_handler(watch),
+            "UNWATCH": room_handler(unwatch),
+            } | {verb: room_handler(command) for verb, command in ROOM_COMMANDS.items()}
 
 async def remove_websocket(websocket: DecoratedWebsocket):
     for room in rooms.values():
-        update = False
-        for user in room.users.values():
-            if user.socket == websocket:
-                user.socket = None
-                update = True
-        if update:
-            await room.alert_player_changes()
+        if room.get_user_by_socket(websocket) is not None:
+            await room.submit(None, lambda room=room: disconnect(room, websocket, {}))
+
+def rate_key(verb: str, room: Room | None) -> str:
+    """Rate limit key for `verb`; verbs that cost more on some board families get their own key."""
+    if room is not None and isinstance(room.board, Invasion): return f"{verb}:Invasion"
+    return verb
+
+async def throttle(websocket: DecoratedWebsocket, data) -> bool:
+    """Charges a request to its connection's and room's rate limits, delaying it briefly if needed.
+    
+    Returns False (after replying RATELIMITED, or ERROR for a malformed BATCH) if the request should be dropped.
+    Nothing is taken from either limit unless both can pay."""
+    if not ratelimit.ENABLED: return True
+    room = rooms.get(data.get("roomId", None), None)
+    if data["verb"] == "BATCH":
+        if (error := batch_error(data)) is not None:  # Keeps client-chosen verbs out of the bucket keys
+            await websocket.send_json(error)
+            return False
+        costs = Counter(rate_key(op["verb"], room) for op in data["ops"])
+        costs[rate_key("BATCH", room)] += 1
+    else:
+        costs = Counter([rate_key(data["verb"], room)])
+    if data["verb"] == "GENERATE": costs["GENERATE"] = max(len(data.get("seeds", [])), 1)
+
+    limiters = [("connection", websocket.limiter)]
+    if room is not None: limiters.append(("room", room.limiter))
+    while True:
+        wait, scope = max((limiter.wait_time(costs), scope) for scope, limiter in limiters)
+        if wait == 0: break
+        if wait > ratelimit.MAX_DELAY:
+            metrics.incr(f"ratelimit.{scope}.rejected")
+            if room is not None: room.metrics[f"ratelimit.{scope}.rejected"] += 1
+            await websocket.send_json({"verb": "RATELIMITED", "retryAfter": round(wait, 3) if wait != float("inf") else None})
+            return False
+        metrics.incr(f"ratelimit.{scope}.delayed")
+        await asyncio.sleep(wait)  # Not reading from the socket meanwhile pushes back on the client
+    for _, limiter in limiters: limiter.take(costs)
+    return True
+
+PING_INTERVAL = 20.0  # Seconds between heartbeats; 0 disables them
+PING_TIMEOUT = 20.0   # Seconds a heartbeat may take, from writing the ping to receiving the pong
+
+async def heartbeat(websocket: DecoratedWebsocket):
+    """Pings the client periodically and aborts the connection if a pong doesn't arrive in time.
+
+    Unlike websockets' own keepalive, the timeout also covers writing the ping, which never completes
+    on a half-open connection whose send buffer has filled with broadcasts."""
+    async def ping_pong():
+        pong = await websocket.ping()
+        await pong
+
+    while True:
+        await asyncio.sleep(PING_INTERVAL)
+        try: await asyncio.wait_for(ping_pong(), PING_TIMEOUT)
+        except asyncio.TimeoutError:
+            metrics.incr("heartbeat.timeouts")
+            _log.warning(f"!PING | {websocket.address}")
+            websocket.transport.abort()  # Drop what's buffered for it now, rather than after close_timeout
+            return
+        except ConnectionClosed: return
+
+async def process_request(path: str, request_headers):
+    return http_api.handle(path, request_headers, rooms, lobby)
 
 async def process(websocket: DecoratedWebsocket):
     websocket.__class__ = DecoratedWebsocket  # Websocket is passed as a WebSocketClientProtocol, but upgraded
-    addr = websocket.remote_address[0]
+    websocket.limiter = RateLimiter(ratelimit.CONNECTION_LIMITS)
+    websocket.watching = None
+    websocket.recording_id = recording.active.connected() if recording.active is not None else 0
+    addr = websocket.address
     _log.info(f"CON | {addr}")
+    pinger = asyncio.create_task(heartbeat(websocket)) if PING_INTERVAL > 0 else None
     try:
         async for received in websocket:
             try:
                 _log.info(f"IN  | {addr} | {received!r}")
                 data = json.loads(received)
+                if recording.active is not None and data.get("verb", None) not in recording.UNRECORDED_VERBS:
+                    recording.active.inbound(websocket.recording_id, received if isinstance(received, str) else received.decode())
                 if data["verb"] not in HANDLERS:
                     _log.warning(f"Bad verb received | {data['verb']}")
+                    await websocket.send_json({"verb": "BADVERB"})
                     continue
+                if not await throttle(websocket, data): continue
+                if DRAINING: continue  # Would miss the handoff; the client is about to be sent away
                 await HANDLERS[data["verb"]](websocket, data)
             except Exception as e:
                 await websocket.send_json({"verb": "ERROR", "message": f"Server Error: {e.__repr__()}"})
@@ -312,25 +503,140 @@ async def process(websocket: DecoratedWebsocket):
         _log.debug(e, exc_info=True)
     
     _log.info(f"DIS | {addr}")
-    exitRoom = websocket.clear_self_from_room()
-    if exitRoom is not None: await exitRoom.alert_player_changes()
+    if recording.active is not None: recording.active.disconnected(websocket.recording_id)
+    if pinger is not None: pinger.cancel()
+    if websocket.watching is not None: websocket.watching.unwatch(websocket)
+    exitRoom = websocket.get_room()
+    if exitRoom is not None: await exitRoom.submit(None, lambda: disconnect(exitRoom, websocket, {}))
 
 CERTS_PATH = "/etc/letsencrypt/live/byngosink-ws.manicjamie.com"
-FULL_CHAIN = f"{CERTS_PATH}/fullchain.pem"
-PRIV_KEY = f"{CERTS_PATH}/privkey.pem"
-
-ssl_context: ssl.SSLContext | None
 
-if os.path.exists(FULL_CHAIN) and os.path.exists(PRIV_KEY):  # Do SSL if the certificates exist, otherwise warn
+def tls_context(certs_path: str) -> ssl.SSLContext | None:
+    full_chain, priv_key = f"{certs_path}/fullchain.pem", f"{certs_path}/privkey.pem"
+    if not (os.path.exists(full_chain) and os.path.exists(priv_key)):  # Do SSL if the certificates exist, otherwise warn
+        _log.warning("Certs not found: SSL not enabled!")
+        return None
     ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-    ssl_context.load_cert_chain(FULL_CHAIN, PRIV_KEY)
-else:
-    _log.warning("Certs not found: SSL not enabled!")
-    ssl_context = None
-
-async def main():
-    async with serve(process, "0.0.0.0", 555, ssl=ssl_context):
-        await asyncio.Future()  # Run forever
+    ssl_context.load_cert_chain(full_chain, priv_key)
+    return ssl_context
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ByngoSink websocket server")
+    parser.add_argument("--loop", choices=("auto", "asyncio", "uvloop"), default="auto",
+                        help="event loop implementation; auto uses uvloop if it is installed")
+    parser.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+
+    listener = parser.add_argument_group("listener")
+    listener.add_argument("--host", default="0.0.0.0")
+    listener.add_argument("--port", type=int, default=555)
+    listener.add_argument("--unix", metavar="PATH",
+                          help="listen on this Unix domain socket instead, without TLS, behind a local reverse proxy")
+    listener.add_argument("--certs", default=CERTS_PATH, help="directory containing fullchain.pem and privkey.pem")
+    listener.add_argument("--no-tls", action="store_true", help="serve plain ws:// even if certificates exist")
+
+    parser.add_argument("--admin-token", default=stats.TOKEN,
+                        help="enables STATS and /stats for holders of this token (default: $BYNGOSINK_ADMIN_TOKEN)")
+
+    parser.add_argument("--record", metavar="PATH", help="record client traffic here for replay.py")
+    parser.add_argument("--no-rate-limits", action="store_true", help="for replaying recorded traffic at full speed")
+
+    restart = parser.add_argument_group("restarts")
+    restart.add_argument("--handoff", metavar="PATH",
+                         help="on SIGTERM, save rooms here for the next process; on startup, restore rooms from here")
+    restart.add_argument("--reconnect-after", type=float, nargs=2, metavar=("MIN", "MAX"), default=RECONNECT_AFTER,
+                         help="range of the random delay drained clients are told to reconnect after")
+
+    ws = parser.add_argument_group("websocket")
+    ws.add_argument("--ping-interval", type=float, default=PING_INTERVAL, help="seconds between heartbeats; 0 disables them")
+    ws.add_argument("--ping-timeout", type=float, default=PING_TIMEOUT,
+                    help="seconds a heartbeat may take before the connection is dropped")
+    ws.add_argument("--max-size", type=int, default=2**20, help="largest accepted incoming message in bytes")
+    ws.add_argument("--max-queue", type=int, default=32, help="incoming messages buffered per connection")
+    ws.add_argument("--write-limit", type=int, default=2**16, help="outgoing buffer high-water mark in bytes")
+    ws.add_argument("--compression", choices=("on", "off"), default="on", help="permessage-deflate")
+    ws.add_argument("--compression-level", type=int, choices=range(0, 10), metavar="0-9",
+                    help="zlib level for outgoing frames (default: zlib's own)")
+    return parser.parse_args(argv)
+
+def websocket_options(args: argparse.Namespace) -> dict:
+    options = {"process_request": process_request, "ping_interval": None,  # See `heartbeat`
+               "max_size": args.max_size,
+               "max_queue": args.max_queue, "write_limit": args.write_limit}
+    if args.compression == "off":
+        options["compression"] = None
+    elif args.compression_level is not None:
+        # Same settings websockets uses by default, plus the level
+        options["extensions"] = [ServerPerMessageDeflateFactory(
+            server_max_window_bits=12, client_max_window_bits=12,
+            compress_settings={"memLevel": 5, "level": args.compression_level})]
+    return options
+
+DRAINING = False
+RECONNECT_AFTER = (1.0, 6.0)  # Drained clients are told to reconnect after a random delay in this range (seconds)
+
+def reconnect_message() -> dict:
+    return {"verb": "RECONNECT", "after": round(uniform(*RECONNECT_AFTER), 3)}
+
+async def drain(server: WebSocketServer, handoff_path: str | None):
+    """Stops accepting connections, hands the rooms over to the next process and sends every client away.
+
+    Each client gets its own reconnect delay, so they don't all arrive at the new process at once."""
+    global DRAINING
+    DRAINING = True
+    server.server.close()
+    _log.warning(f"Draining {len(server.websockets)} connections")
+    await asyncio.gather(*[room.submit(None, lambda: None) for room in rooms.values()])  # Apply already queued commands
+    if handoff_path is not None:
+        handoff.save(handoff_path, rooms)
+        _log.warning(f"Saved {len(rooms)} rooms to {handoff_path}")
+
+    async def send_away(websocket: DecoratedWebsocket):
+        await websocket.send_json(reconnect_message())
+        await websocket.close(1012, "Server restarting")
+    await asyncio.gather(*[send_away(websocket) for websocket in list(server.websockets)], return_exceptions=True)
+
+async def main(args: argparse.Namespace):
+    global PING_INTERVAL, PING_TIMEOUT, RECONNECT_AFTER
+    PING_INTERVAL, PING_TIMEOUT = args.ping_interval, args.ping_timeout
+    RECONNECT_AFTER = tuple(args.reconnect_after)
+    stats.TOKEN = args.admin_token
+    ratelimit.ENABLED = not args.no_rate_limits
+    if args.record is not None: recording.active = recording.Recorder(args.record)
+    stats.start()
+    generation.start()
+    if args.handoff is not None and os.path.exists(args.handoff):
+        rooms.update(handoff.load(args.handoff))
+        _log.info(f"Restored {len(rooms)} rooms from {args.handoff}")
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try: asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        except NotImplementedError: pass  # Windows: no drain
+
+    options = websocket_options(args)
+    if args.unix:
+        server = unix_serve(process, args.unix, **options)
+        _log.info(f"Listening on {args.unix}")
+    else:
+        ssl_context = None if args.no_tls else tls_context(args.certs)
+        server = serve(process, args.host, args.port, ssl=ssl_context, **options)
+        _log.info(f"Listening on {args.host}:{args.port}{'' if ssl_context else ' (no TLS)'}")
+    async with server as ws_server:
+        await stop.wait()
+        await drain(ws_server, args.handoff)
+    if recording.active is not None: recording.active.close()
+
+def run(coro, loop: str):
+    if loop != "asyncio":
+        try: import uvloop
+        except ImportError:
+            if loop == "uvloop": raise
+        else:
+            _log.info("Using uvloop")
+            return uvloop.run(coro)
+    return asyncio.run(coro)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    _log.setLevel(args.log_level)
+    run(main(args), args.loop)
@@ -0,0 +1,188 @@
+"""Diagnostics for finding out which room, board type or verb is slowing the server down.
+
+Served to admins by the STATS verb and the /stats HTTP route, both authenticated by `TOKEN`.
+Heap snapshots (tracemalloc) and a sampling profiler of the event loop thread can be switched on and off at runtime."""
+from collections import Counter, deque
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import metrics
+from boards import board_alias
+from rooms import Room
+
+TOKEN: str | None = os.environ.get("BYNGOSINK_ADMIN_TOKEN", None)  # Admin access is off without one
+LAG_INTERVAL = 0.25  # Seconds between event loop lag probes
+SAMPLE_INTERVAL = 0.005  # Seconds between profiler samples
+TRACEMALLOC_FRAMES = 10
+SWITCH_VALUES = {True: True, "on": True, "1": True, "true": True,
+                 False: False, "off": False, "0": False, "false": False}  # Accepted values of on/off options
+
+def authorised(token) -> bool:
+    return TOKEN is not None and isinstance(token, str) and hmac.compare_digest(token.encode(), TOKEN.encode())
+
+class LagMonitor():
+    """How late the event loop wakes up a task that sleeps for `LAG_INTERVAL`."""
+    def __init__(self) -> None:
+        self.recent: deque[float] = deque(maxlen=int(60 / LAG_INTERVAL))  # Last minute
+        self.task: asyncio.Task | None = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            self.recent.append(max(loop.time() - expected, 0))
+
+    def start(self):
+        self.task = asyncio.create_task(self._run(), name="lag-monitor")
+
+    def report(self) -> dict:
+        recent = sorted(self.recent)
+        if not recent: return {}
+        return {"lastMs": round(self.recent[-1] * 1e3, 2), "p50Ms": round(recent[len(recent) // 2] * 1e3, 2),
+                "maxMs": round(recent[-1] * 1e3, 2)}
+
+class Sampler():
+    """Samples the event loop thread's stack from a background thread, so handlers need no instrumentation."""
+    def __init__(self, thread_id: int) -> None:
+        self.thread_id = thread_id
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.started = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool: return self._thread is not None
+
+    def start(self):
+        if self.running: return
+        self.stacks.clear()
+        self.started = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running: return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id, None)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            with self._lock: self.stacks[tuple(reversed(stack))] += 1
+
+    def report(self, top: int) -> dict:
+        with self._lock: stacks = self.stacks.copy()
+        samples = sum(stacks.values())
+        own, inclusive = Counter(), Counter()
+        for stack, n in stacks.items():
+            if not stack: continue
+            own[stack[-1]] += n
+            for function in set(stack): inclusive[function] += n
+        share = lambda counts: [{"function": f, "share": round(n / samples, 4)} for f, n in counts.most_common(top)]
+        return {"running": self.running, "seconds": round(time.monotonic() - self.started, 1) if self.started else 0,
+                "samples": samples, "self": share(own) if samples else [], "inclusive": share(inclusive) if samples else [],
+                "stacks": [{"stack": ";".join(s), "samples": n} for s, n in stacks.most_common(top)]}
+
+lag = LagMonitor()
+sampler: Sampler | None = None
+_heap_baseline: tracemalloc.Snapshot | None = None
+
+def start():
+    """Starts the lag monitor and sets the profiler on the current thread; call from the event loop."""
+    global sampler
+    lag.start()
+    sampler = Sampler(threading.get_ident())
+
+def set_tracemalloc(enabled: bool):
+    global _heap_baseline
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        _heap_baseline = tracemalloc.take_snapshot()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+        _heap_baseline = None
+
+def set_profiling(enabled: bool):
+    if enabled: sampler.start()
+    else: sampler.stop()
+
+def heap_report(top: int) -> dict:
+    """Allocation growth by line since tracing was switched on."""
+    if not tracemalloc.is_tracing(): return {"running": False}
+    current, peak = tracemalloc.get_traced_memory()
+    diff = tracemalloc.take_snapshot().compare_to(_heap_baseline, "lineno")
+    return {"running": True, "tracedBytes": current, "peakBytes": peak,
+            "growth": [{"line": str(d.traceback), "bytes": d.size_diff, "count": d.count_diff} for d in diff[:top]]}
+
+_SHARED = frozenset(("socket", "room", "generator", "watching"))  # Attributes pointing at things a room doesn't own
+
+def _deep_size(obj, seen: set[int]) -> int:
+    if obj is None or id(obj) in seen: return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict): size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)): size += sum(_deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(_deep_size(getattr(obj, a, None), seen) for a in obj.__slots__ if a not in _SHARED)
+    elif hasattr(obj, "__dict__"):
+        size += sum(_deep_size(v, seen) for a, v in vars(obj).items() if a not in _SHARED)
+    return size
+
+def room_bytes(room: Room) -> int:
+    """Rough memory held by `room`. Goals and rank tables are shared with other boards, so they aren't counted."""
+    board = room.board
+    seen = {id(g) for g in board.goals} | {id(getattr(board, "ranks", None)), id(board.languages)}
+    return sum(_deep_size(part, seen) for part in
+               (board, room.users, room.teams, room.events, room._frames, room._announcements, room._member_deltas))
+
+def room_report(room: Room) -> dict:
+    return {"id": room.id, "name": room.name, "board": board_alias(room.board), "game": room.board.game,
+            "users": len(room.users), "connected": len(room.connected_users()),
+            "spectators": sum(1 for u in room.users.values() if u.spectate), "watchers": room.watcher_count(),
+            "teams": len(room.teams), "cells": room.board.width * room.board.height, "version": room.version,
+            "estimatedBytes": room_bytes(room), "bytesSent": room.metrics["bytes.sent"],
+            "cpuMs": round(room.metrics["cpu.ns"] / 1e6, 3)}
+
+def report(rooms: dict[str, Room], top: int = 10) -> dict:
+    entries = [room_report(room) for room in rooms.values()]
+    by_board = Counter()
+    for e in entries: by_board[e["board"]] += e["cpuMs"]
+    return {"rooms": len(entries),
+            "loopLag": lag.report(),
+            "topRooms": {"bytesSent": sorted(entries, key=lambda e: -e["bytesSent"])[:top],
+                         "cpu": sorted(entries, key=lambda e: -e["cpuMs"])[:top],
+                         "estimatedBytes": sorted(entries, key=lambda e: -e["estimatedBytes"])[:top]},
+            "cpuMsByBoard": {board: round(ms, 3) for board, ms in by_board.most_common()},
+            "metrics": metrics.snapshot(),
+            "tracemalloc": heap_report(top),
+            "profile": sampler.report(top) if sampler is not None else {"running": False}}
+
+def switch(options: dict, name: str) -> bool | None:
+    """The on/off option `name` in `options`, or None if it isn't given. Raises ValueError for anything else."""
+    if name not in options: return None
+    value = options[name]
+    try: return SWITCH_VALUES[value.lower() if isinstance(value, str) else value]  # 0 and 1 match False and True
+    except (KeyError, TypeError): raise ValueError(f"{name} must be on or off, not {value!r}") from None
+
+def apply(options: dict, rooms: dict[str, Room]) -> dict:
+    """Applies the `tracemalloc`/`profile` switches in `options`, then reports.
+    
+    Raises ValueError, before switching anything, if an option has a bad value."""
+    tracing, profiling, top = switch(options, "tracemalloc"), switch(options, "profile"), int(options.get("top", 10))
+    if tracing is not None: set_tracemalloc(tracing)
+    if profiling is not None: set_profiling(profiling)
+    return report(rooms, top)
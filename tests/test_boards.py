@@ -0,0 +1,39 @@
+import pytest
+
+from boards import create_board
+from generators import get_generator
+
+GOALS = [f"goal {i}" for i in range(169)]
+
+def fixed_board(board_str):
+    return create_board(board_str, get_generator("Hollow Knight", "Fixed", goals=GOALS), "0")
+
+def test_invasion_own_edge_is_not_arrival():
+    board = fixed_board("Invasion")
+    for index in range(5):  # Along the top edge, which also reaches the far side from the left
+        assert board.mark(index, "a")
+    assert board.result is None
+
+def test_invasion_arrival():
+    board = fixed_board("Invasion")
+    for index in (0, 5, 10, 15, 1, 6, 11, 16, 2, 7, 12, 17):  # Top down, four ranks deep; left one is settled
+        assert board.mark(index, "a")
+    assert board.result is None
+    assert board.mark(22, "a")
+    assert board.result == {"teamId": "a", "reason": "arrival"}
+
+def test_line_announced_once():
+    board = fixed_board("Non-Lockout")
+    for index in range(5): board.mark(index, "a")
+    assert [e["verb"] for e in board.pop_events()] == ["LINE"]
+    board.unmark(4, "a")
+    board.mark(4, "a")
+    assert board.pop_events() == []
+
+@pytest.mark.parametrize("board_str", ["Exploration", "GTTOS"])
+def test_hidden_boards_show_result(board_str):
+    board = fixed_board(board_str)
+    board.result = {"teamId": "a", "reason": "arrival"}
+    assert board.get_minimum_view()["result"] == board.result
+    assert board.get_team_view("b")["result"] == board.result
+    assert board.get_spectator_view()["result"] == board.result
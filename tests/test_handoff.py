@@ -0,0 +1,66 @@
+import json
+
+import handoff
+from rooms import FixedRoom, Room
+
+GOALS = [f"goal {i}" for i in range(25)]
+
+def make_room() -> Room:
+    room = FixedRoom("room", "Hollow Knight", "Invasion", GOALS)
+    player, spectator = room.users[room.add_user("a")], room.users[room.add_user("b")]
+    team = room.create_team("A", "#f00")
+    team.add_user(player)
+    player.teamId = team.id
+    room.spectators.add_user(spectator)  # As the SPECTATE command does
+    spectator.teamId, spectator.spectate = room.spectators.id, 1
+    room.board.mark(0, team.id)
+    return room
+
+def test_round_trip(tmp_path):
+    room = make_room()
+    path = str(tmp_path / "rooms.json")
+    handoff.save(path, {room.id: room})
+    restored = handoff.load(path)[room.id]
+
+    assert restored.board.get_state() == room.board.get_state()
+    assert restored.board.generator is room.board.generator
+    assert {t.id: [u.id for u in t.members] for t in restored.teams.values()} == \
+           {t.id: [u.id for u in t.members] for t in room.teams.values()}
+    assert all(u.socket is None for u in restored.users.values())
+    assert not (tmp_path / "rooms.json").exists()
+
+def test_round_trip_keeps_spectators(tmp_path):
+    room = make_room()
+    path = str(tmp_path / "rooms.json")
+    handoff.save(path, {room.id: room})
+    restored = handoff.load(path)[room.id]
+
+    spectator = next(u for u in restored.users.values() if u.name == "b")
+    assert spectator.teamId == restored.spectators.id == room.spectators.id
+    assert restored.spectators.members == [spectator]
+    assert spectator.spectate == 1
+
+def test_round_trip_after_spectator_exits(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Importing the server opens a log file under ./logs
+    from socket_handler import exit_room
+    room = make_room()
+    spectator = next(u for u in room.users.values() if u.name == "b")
+    exit_room(room, None, {"userId": spectator.id})
+    path = str(tmp_path / "rooms.json")
+    handoff.save(path, {room.id: room})
+    restored = handoff.load(path)[room.id]
+
+    assert restored.spectators.members == []
+    assert [u.name for u in restored.users.values()] == ["a"]
+
+def test_restore_skips_unknown_members(tmp_path):
+    room = make_room()
+    state = room.get_state()
+    state["spectators"]["members"].append("gone")
+    state["teams"][0]["members"].append("gone")
+    path = str(tmp_path / "rooms.json")
+    with open(path, "w", encoding="utf-8") as f: json.dump({"format": handoff.FORMAT, "rooms": [state]}, f)
+    restored = handoff.load(path)[room.id]
+
+    assert [u.name for u in restored.spectators.members] == ["b"]
+    assert [u.name for t in restored.teams.values() for u in t.members] == ["a"]
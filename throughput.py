@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""End-to-end throughput comparison between server configurations.
+
+Starts socket_handler.py once per configuration, opens rooms full of players and WATCH subscribers, and has
+one player per room mark and unmark at a fixed rate (below the rate limits). With the offered load fixed,
+configurations differ in server CPU per operation, MARK round-trip latency and bytes on the wire:
+
+    python throughput.py
+    python throughput.py -c asyncio -c "no compression" --rooms 50 --watchers 40 -o throughput.json
+
+Server CPU is read from /proc, so it is only reported on Linux.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from websockets.client import WebSocketClientProtocol, connect, unix_connect
+
+GAME = "Hollow Knight"
+GENERATOR = "Item Randomizer"
+BOARD = "Non-Lockout"
+
+UNIX_PATH = os.path.join(tempfile.gettempdir(), "byngosink-throughput.sock")
+CONFIGS: dict[str, list[str]] = {
+    "asyncio": ["--loop", "asyncio"],
+    "uvloop": ["--loop", "uvloop"],
+    "no compression": ["--loop", "asyncio", "--compression", "off"],
+    "compression level 1": ["--loop", "asyncio", "--compression-level", "1"],
+    "unix socket": ["--loop", "asyncio", "--unix", UNIX_PATH],
+}
+
+class CountingProtocol(WebSocketClientProtocol):
+    """Counts bytes as they arrive on the wire, before decompression."""
+    wire_bytes = 0
+    def data_received(self, data: bytes) -> None:
+        CountingProtocol.wire_bytes += len(data)
+        super().data_received(data)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def cpu_seconds(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/stat") as f: fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+
+async def start_server(server_args: list[str], connect_to, timeout: float = 30) -> subprocess.Popen:
+    """Starts socket_handler.py (without TLS) and waits until `connect_to()` can open a connection to it."""
+    command = [sys.executable, "socket_handler.py", "--no-tls", "--log-level", "WARNING"]
+    server = subprocess.Popen(command + server_args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              start_new_session=True)  # Own process group, shared with its generation workers
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with connect_to(): return server
+        except OSError:
+            if time.monotonic() > deadline:
+                os.killpg(server.pid, signal.SIGKILL)
+                raise
+            await asyncio.sleep(0.1)
+        except BaseException:
+            os.killpg(server.pid, signal.SIGKILL)
+            raise
+
+def stop_server(server: subprocess.Popen):
+    os.killpg(server.pid, signal.SIGTERM)
+    server.wait()
+
+class Load():
+    def __init__(self, server_args: list[str], args: argparse.Namespace) -> None:
+        self.server_args = server_args
+        self.unix = server_args[server_args.index("--unix") + 1] if "--unix" in server_args else None
+        self.port = free_port()
+        self.args = args
+        self.frames: Counter[str] = Counter()
+        self.latencies: list[float] = []
+        self.ops = 0
+
+    def connect(self):
+        kwargs = {"create_protocol": CountingProtocol, "max_size": None}
+        if self.unix: return unix_connect(self.unix, "ws://localhost/", **kwargs)
+        return connect(f"ws://127.0.0.1:{self.port}/", **kwargs)
+
+    async def request(self, ws, data: dict, *verbs: str) -> dict:
+        await ws.send(json.dumps(data))
+        while True:
+            reply = json.loads(await ws.recv())
+            if reply["verb"] in verbs: return reply
+
+    async def listen(self, ws):
+        async for message in ws:
+            self.frames[json.loads(message)["verb"]] += 1
+
+    async def room(self, index: int, stop: asyncio.Event, ready: asyncio.Barrier):
+        args = self.args
+        async with self.connect() as host:
+            opened = await self.request(host, {"verb": "OPEN", "roomName": f"bench-{index}", "username": "host", "game": GAME,
+                                               "generator": GENERATOR, "board": BOARD, "seed": str(index)}, "OPENED")
+            room_id = opened["roomId"]
+            await self.request(host, {"verb": "CREATE_TEAM", "roomId": room_id, "name": "team", "colour": "#ff0000"}, "TEAM_CREATED")
+
+            async def member(data: dict):
+                async with self.connect() as ws:
+                    await ws.send(json.dumps(data))
+                    await ready.wait()
+                    listener = asyncio.create_task(self.listen(ws))
+                    await stop.wait()
+                    listener.cancel()
+
+            members = [asyncio.create_task(member({"verb": "JOIN", "roomId": room_id, "username": f"player-{i}"}))
+                       for i in range(args.players)]
+            members += [asyncio.create_task(member({"verb": "WATCH", "roomId": room_id, "view": "spectator"}))
+                        for _ in range(args.watchers)]
+            await ready.wait()
+
+            interval = 1 / args.rate
+            next_op = time.monotonic()
+            marked = False
+            while not stop.is_set():
+                started = time.perf_counter()
+                await self.request(host, {"verb": "UNMARK" if marked else "MARK", "roomId": room_id, "goalId": index % 25},
+                                   "MARKED", "UNMARKED", "NOMARK", "NOUNMARK", "RATELIMITED")
+                self.latencies.append(time.perf_counter() - started)
+                self.ops += 1
+                marked = not marked
+                next_op += interval
+                await asyncio.sleep(max(0, next_op - time.monotonic()))
+            await asyncio.gather(*members)
+
+    async def run(self) -> dict:
+        args = self.args
+        stop = asyncio.Event()
+        ready = asyncio.Barrier(args.rooms * (1 + args.players + args.watchers) + 1)
+        rooms = [asyncio.create_task(self.room(i, stop, ready)) for i in range(args.rooms)]
+        await ready.wait()
+        await asyncio.sleep(args.warmup)
+
+        self.frames.clear()
+        self.latencies.clear()
+        self.ops = 0
+        CountingProtocol.wire_bytes = 0
+        cpu_start, started = cpu_seconds(self.server.pid), time.perf_counter()
+        await asyncio.sleep(args.duration)
+        cpu_end, elapsed = cpu_seconds(self.server.pid), time.perf_counter() - started
+        frames, ops, latencies, wire_bytes = sum(self.frames.values()), self.ops, sorted(self.latencies), CountingProtocol.wire_bytes
+
+        stop.set()
+        await asyncio.gather(*rooms)
+        cpu = None if cpu_start is None or cpu_end is None else cpu_end - cpu_start
+        return {"opsPerSecond": ops / elapsed,
+                "framesPerSecond": frames / elapsed,
+                "wireBytesPerSecond": wire_bytes / elapsed,
+                "serverCpu": cpu and cpu / elapsed,
+                "serverCpuPerOpMs": cpu and ops and cpu / ops * 1e3,
+                "latencyP50Ms": statistics.median(latencies) * 1e3 if latencies else None,
+                "latencyP99Ms": latencies[int(len(latencies) * 0.99)] * 1e3 if latencies else None}
+
+    async def __aenter__(self):
+        self.server = await start_server(["--port", str(self.port)] + self.server_args, self.connect)
+        return self
+
+    async def __aexit__(self, *exc):
+        stop_server(self.server)
+        if self.unix and os.path.exists(self.unix): os.remove(self.unix)
+
+def uvloop_available() -> bool:
+    try: import uvloop
+    except ImportError: return False
+    return True
+
+async def benchmark(args: argparse.Namespace) -> dict:
+    results = {}
+    for name in args.config or CONFIGS:
+        server_args = CONFIGS[name]
+        if "uvloop" in server_args and not uvloop_available():
+            print(f"{name:<24} skipped: uvloop is not installed")
+            continue
+        async with Load(server_args, args) as load:
+            results[name] = result = await load.run()
+        cpu = "n/a" if result["serverCpu"] is None else f"{result['serverCpu'] * 100:5.1f}% cpu {result['serverCpuPerOpMs']:7.3f}ms/op"
+        print(f"{name:<24} {result['opsPerSecond']:8.1f} ops/s {result['framesPerSecond']:9.1f} frames/s "
+              f"{result['wireBytesPerSecond'] / 1024:9.1f} KiB/s | {cpu} | "
+              f"p50 {result['latencyP50Ms']:6.2f}ms p99 {result['latencyP99Ms']:6.2f}ms")
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", "--config", action="append", choices=CONFIGS, help="only run these configurations")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--players", type=int, default=4, help="joined users per room besides the marking host")
+    parser.add_argument("--watchers", type=int, default=20, help="WATCH subscribers per room")
+    parser.add_argument("--rate", type=float, default=8, help="marks and unmarks per second per room")
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(benchmark(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=4)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())